@@ -1,30 +1,12 @@
 import streamlit as st
-import torch
-from collections import OrderedDict
-from torch.serialization import safe_globals
-import lightning.fabric.wrappers
-from pytorch_lightning import LightningModule
-import plotly.express as px
 from PIL import Image
-from prediction import pred_class
 import numpy as np
-import plotly.graph_objects as go
 import os
-import base64
-import io
-import gdown
-import timm
-from torchvision import transforms
-
-# Fix for PyTorch 2.2.0 compatibility
-try:
-    from torch.cuda.amp import GradScaler
-except ImportError:
-    try:
-        from torch.amp import GradScaler
-    except ImportError:
-        # Fallback for older versions
-        GradScaler = None
+import time
+from static_assets import build_banner_variants, minify_css
+
+# torch / prediction ถูก import หลังส่วน static ของหน้าเว็บ (ดูด้านล่าง) เพื่อให้หน้าเว็บแสดงผลได้ก่อน
+# ส่วน artifacts (gdown), pandas และ plotly ถูก import เฉพาะตอนที่ต้องใช้จริง
 
 # Page Configuration
 st.set_page_config(
@@ -34,37 +16,39 @@ st.set_page_config(
     initial_sidebar_state="collapsed"
 )
 
-# Function to encode image to base64
-@st.cache_data
-def get_base64_of_bin_file(bin_file):
-    """Convert binary file to base64 string"""
-    try:
-        with open(bin_file, 'rb') as f:
-            data = f.read()
-        return base64.b64encode(data).decode()
-    except Exception as e:
-        st.error(f"Error loading image: {e}")
-        return None
-
 def create_css_with_banner():
     banner_paths = ["banner01.png", "images/banner01.png", "assets/banner01.png", "./banner01.png"]
-    banner_base64 = None
-    banner_found = False
+    banner_variants = None
 
     for path in banner_paths:
         if os.path.exists(path):
-            banner_base64 = get_base64_of_bin_file(path)
-            if banner_base64:
-                banner_found = True
+            try:
+                banner_variants = build_banner_variants(path)
                 break
-
-    # CSS สำหรับ background
-    if banner_base64:
+            except Exception as e:
+                st.warning(f"Error preparing banner: {e}")
+
+    # CSS สำหรับ background: ใช้ไฟล์ใน static/ (WebP ตามความกว้างจอ) แทนการฝัง base64
+    banner_media = ""
+    if banner_variants:
+        webp = banner_variants["webp"]
+        widths = sorted(webp)
+        default_width = widths[len(widths) // 2]
+        png_url = banner_variants["png"][0]
         banner_bg = f"""
-        background: url(data:image/png;base64,{banner_base64}) no-repeat center center;
+        background: url("{png_url}") no-repeat center center;
+        background-image: url("{webp[default_width]}");
         background-size: cover;
         background-position: center center;
         """
+        banner_media = f"""
+@media (max-width: {widths[0]}px) {{
+    .banner-section {{ background-image: url("{webp[widths[0]]}"); }}
+}}
+@media (min-width: {default_width + 1}px) {{
+    .banner-section {{ background-image: url("{webp[widths[-1]]}"); }}
+}}
+"""
     else:
         # ใช้ raw GitHub image แทน gradient
         banner_url = "https://raw.githubusercontent.com/aoixcrx/emotion-app/main/banner01.png"
@@ -908,11 +892,17 @@ h1, h2, h3 {{
         padding: 1.5rem;
     }}
 }}
+{banner_media}
 </style>
 """
 
+# สร้าง CSS ครั้งเดียวต่อ process (ไม่ต้องประกอบ f-string ใหม่ทุก rerun)
+@st.cache_resource
+def get_page_css():
+    return minify_css(create_css_with_banner())
+
 # Apply CSS
-st.markdown(create_css_with_banner(), unsafe_allow_html=True)
+st.markdown(get_page_css(), unsafe_allow_html=True)
 
 # Logo Bar with FontAwesome CDN
 st.markdown("""
@@ -1003,114 +993,455 @@ st.markdown("""
 </div>
 """, unsafe_allow_html=True)
 
+# Heavy imports: โหลดหลังจาก CSS/banner ถูกส่งไปที่ browser แล้ว
+import torch
+from prediction import Predictor, build_transform, preprocess_cv2, load_checkpoint, load_fast, TTA_NUM_VIEWS
+from prediction_cache import PredictionCache, make_key, model_identity
+from metrics import METRICS, timed
+
 # กำหนดชื่อคลาสอารมณ์ที่โมเดลสามารถทำนายได้
 class_names = ["Fear", "Happy", "Neutral", "Sad"]
 
-# ฟังก์ชันทำนายที่แก้ไขแล้ว
-def pred_class(model, image, class_names, device='cpu'):
-    """
-    ฟังก์ชันทำนายอารมณ์จากภาพ
-    
-    Args:
-        model: โมเดล PyTorch ที่โหลดแล้ว
-        image: PIL Image object
-        class_names: รายชื่อคลาสอารมณ์
-        device: device ที่ใช้ ('cpu' หรือ 'cuda')
-    
-    Returns:
-        tuple: (predicted_class_name, confidence_score, all_probabilities)
-    """
-    try:
-        # Image preprocessing
-        transform = transforms.Compose([
-            transforms.Resize((224, 224)),
-            transforms.ToTensor(),
-            transforms.Normalize(mean=[0.485, 0.456, 0.406], 
-                               std=[0.229, 0.224, 0.225])
-        ])
-        
-        # Transform image
-        img_tensor = transform(image).unsqueeze(0).to(device)
-        img_tensor = img_tensor.float()
-        
-        # Prediction
-        model.eval()
-        with torch.no_grad():
-            outputs = model(img_tensor)
-            probabilities = torch.nn.functional.softmax(outputs, dim=1)
-            predicted_idx = torch.argmax(probabilities, dim=1).item()
-            confidence = probabilities[0][predicted_idx].item()
-            
-        # Get all probabilities
-        all_probs = probabilities[0].cpu().numpy()
-        predicted_class = class_names[predicted_idx]
-        
-        return predicted_class, confidence, all_probs
-        
-    except Exception as e:
-        st.error(f"Error in prediction: {str(e)}")
-        return None, 0.0, None
-
-# Load Model
+MODEL_PATH = "efficientnet_b3_checkpoint_fold1.pt"
+# "pil" (torchvision transform) หรือ "cv2" (decode + resize ด้วย OpenCV จาก bytes)
+PREPROCESS_BACKEND = os.environ.get("EMOTION_PREPROCESS", "pil")
+# "torch" (eager), "onnx" (ONNX Runtime CPU) หรือ "int8" (quantized TorchScript)
+MODEL_BACKEND = os.environ.get("EMOTION_BACKEND", "torch")
+ONNX_PATH = os.environ.get("EMOTION_ONNX_PATH", "efficientnet_b3_fold1.onnx")
+INT8_PATH = os.environ.get("EMOTION_INT8_PATH", "efficientnet_b3_fold1_int8.torchscript")
+# ไฟล์ safetensors จาก convert_checkpoint.py (โหลดเร็วกว่า ใช้ถ้ามีอยู่)
+FAST_WEIGHTS_PATH = os.environ.get("EMOTION_FAST_WEIGHTS", "efficientnet_b3_fold1.safetensors")
+# Micro-batching: รวม request จากทุก session เป็น batch เดียว (N = ขนาด batch, T = เวลารอสูงสุด ms)
+MICROBATCH = os.environ.get("EMOTION_MICROBATCH", "0") == "1"
+MICROBATCH_SIZE = int(os.environ.get("EMOTION_MICROBATCH_SIZE", "16"))
+MICROBATCH_WAIT_MS = float(os.environ.get("EMOTION_MICROBATCH_WAIT_MS", "5"))
+# Ensemble: โหลดทุก fold (efficientnet_b3_checkpoint_fold*.pt) แล้วเฉลี่ย softmax
+ENSEMBLE = os.environ.get("EMOTION_ENSEMBLE", "0") == "1"
+# แสดง debug panel ของเวลาแต่ละขั้นตอน (หรือเปิดด้วย ?debug=1) และ port สำหรับ Prometheus /metrics
+DEBUG_PANEL = os.environ.get("EMOTION_DEBUG", "0") == "1"
+METRICS_PORT = os.environ.get("EMOTION_METRICS_PORT")
+# runtime profile สำหรับจำนวน thread ของ torch: "latency", "balanced" หรือ "throughput"
+RUNTIME_PROFILE = os.environ.get("EMOTION_PROFILE")
+# โหมด CPU ของ backend torch: "fp32" หรือ "bf16" (autocast) และ layout แบบ channels-last
+# (ถ้า CPU ไม่รองรับ bf16 จะกลับไปใช้ fp32; ดู drift/latency เทียบ fp32 ด้วย python precision.py)
+PRECISION = os.environ.get("EMOTION_PRECISION", "fp32")
+CHANNELS_LAST = os.environ.get("EMOTION_CHANNELS_LAST", "0") == "1"
+# จำนวนผลทำนายสูงสุดที่เก็บต่อ session (เก่าสุดถูกแทนที่เมื่อเต็ม หน่วยความจำต่อ session จึงคงที่)
+HISTORY_MAX = int(os.environ.get("EMOTION_HISTORY_MAX", "500"))
+
+# Load Model: คืน (model, device, model_id) โดย model_id บอก backend และไฟล์ที่โหลดได้จริง
+# (สร้างไฟล์ .onnx / int8 ใหม่ ขนาดหรือเวลาแก้ไขเปลี่ยน key จึงเปลี่ยนตาม ไม่ใช้ผลเก่าใน cache)
+# (ถ้า int8/ONNX โหลดไม่ได้แล้วถอยกลับไป fp32 ผลต้องไม่ถูก cache ไว้ใต้ key ของ int8/ONNX)
 @st.cache_resource
 def load_model():
 
-    model_path = "efficientnet_b3_checkpoint_fold1.pt"
+    model_path = MODEL_PATH
     device = torch.device("cuda" if torch.cuda.is_available() else 'cpu')
+
+    # Streamlit เป็น process เดียว จึงใช้เฉพาะจำนวน thread ต่อ worker ของ profile
+    if RUNTIME_PROFILE:
+        try:
+            from runtime_profiles import apply_profile, resolve_profile
+            apply_profile(resolve_profile(RUNTIME_PROFILE))
+        except Exception as e:
+            st.warning(f"Could not apply runtime profile: {e}")
+
+    # โมเดล int8 (สร้างด้วย quantize.py) รันบน CPU เท่านั้น และไม่ต้องใช้ checkpoint fp32
+    if MODEL_BACKEND == "int8":
+        try:
+            from quantize import load_int8
+            return load_int8(INT8_PATH), torch.device("cpu"), f"{model_identity(INT8_PATH)}:int8"
+        except Exception as e:
+            st.error(f"Error loading int8 model, falling back to fp32: {e}")
     
-    # ถ้าไฟล์ไม่มี ให้ดาวน์โหลดก่อน
-    if not os.path.exists(model_path):
+    model = None
+    model_id = None
+    # Ensemble: หา fold checkpoint ก่อน (ทั้งในโฟลเดอร์และ cache กลางของ artifacts.py)
+    # ถ้ามีมากกว่าหนึ่ง fold ก็ไม่ต้องโหลดโมเดลเดี่ยวแล้วทิ้ง
+    if ENSEMBLE:
+        try:
+            from ensemble import find_fold_checkpoints, load_ensemble
+            fold_paths = find_fold_checkpoints()
+            if len(fold_paths) > 1:
+                model = load_ensemble(fold_paths, device)
+                # id มาจากไฟล์ทุก fold ที่โหลดจริง ไม่ใช่ id เดียวกับโมเดลเดี่ยว
+                model_id = "+".join(model_identity(path) for path in fold_paths) + ":ensemble"
+            else:
+                st.warning("Ensemble mode needs more than one fold checkpoint; using a single model")
+        except Exception as e:
+            st.error(f"Error loading fold ensemble, using a single model: {e}")
+
+    if model is None and os.path.exists(FAST_WEIGHTS_PATH):
+        try:
+            model = load_fast(FAST_WEIGHTS_PATH, device)
+            # สร้างไฟล์ safetensors ใหม่ id ก็เปลี่ยน (MODEL_PATH อาจเป็นแค่ LFS pointer)
+            model_id = f"{model_identity(FAST_WEIGHTS_PATH)}:torch"
+        except Exception as e:
+            st.warning(f"Fast weights unavailable, loading checkpoint instead: {e}")
+
+    # ถ้าไฟล์ไม่มีหรือเป็นแค่ Git LFS pointer ให้ดาวน์โหลดเข้า cache กลาง (ตรวจ sha256, ต่อไฟล์ที่โหลดค้างได้)
+    if model is None:
         try:
-            url = "https://drive.google.com/uc?id=1TUVnEHkl3fd-5olrDR-wTlkGFKakAIaB"
-            gdown.download(url, model_path, quiet=False)
+            from artifacts import resolve_model_checkpoint
+            model_path = resolve_model_checkpoint(model_path)
         except Exception as e:
             st.error(f"Error downloading model: {e}")
-            return None, device
+            return None, device, None
         
-    # ✅ โหลด checkpoint แบบ allow Lightning class
-    try:
-        with safe_globals([lightning.fabric.wrappers._FabricModule]):
-            ckpt = torch.load(model_path, map_location="cpu", weights_only=False)
-    except Exception as e:
-        st.error(f"Error loading model: {e}")
-        return None, device
-        
-    # ดึง state_dict จาก checkpoint
-    if isinstance(ckpt, dict) and "state_dict" in ckpt:
-        state_dict = ckpt["state_dict"]
-    else:
-        # fallback: ถ้าโหลดได้เป็น object ให้ดึง state_dict() โดยตรง
+    # ✅ โหลด checkpoint แบบ allow Lightning class แล้ว map key (ลบ prefix 'model.')
+    if model is None:
         try:
-            state_dict = ckpt.state_dict()
-        except Exception:
-            st.error("Checkpoint format not supported.{e}")
-            return None, device
+            model = load_checkpoint(model_path, device)
+            model_id = f"{model_identity(model_path)}:torch"
+        except Exception as e:
+            st.error(f"Error loading model: {e}")
+            return None, device, None
+
+    # ใช้ ONNX Runtime แทน PyTorch eager ถ้าตั้งค่าไว้
+    if MODEL_BACKEND == "onnx":
+        try:
+            from onnx_backend import OnnxModel, export_onnx
+            if not os.path.exists(ONNX_PATH):
+                export_onnx(model, ONNX_PATH)
+            return OnnxModel(ONNX_PATH), torch.device("cpu"), f"{model_identity(ONNX_PATH)}:onnx"
+        except Exception as e:
+            st.error(f"Error loading ONNX model, falling back to PyTorch: {e}")
+
+    if PRECISION != "fp32" or CHANNELS_LAST:
+        try:
+            from precision import optimize_model
+            model, used, reason = optimize_model(model, PRECISION, CHANNELS_LAST, device)
+            if reason:
+                st.warning(f"Precision {PRECISION} unavailable ({reason}); using {used}")
+            # bf16 ให้ผลต่างจาก fp32 จึงแยก cache ตาม precision ที่ใช้จริงและ layout
+            if used != "fp32":
+                model_id += f":{used}"
+            if CHANNELS_LAST:
+                model_id += ":channels_last"
+        except Exception as e:
+            st.error(f"Error applying precision settings, using fp32: {e}")
+
+    return model, device, model_id
+
+
+# Prediction cache ใช้ร่วมกันทุก session
+@st.cache_resource
+def get_prediction_cache():
+    max_mb = float(os.environ.get("EMOTION_CACHE_MB", "64"))
+    db_path = os.environ.get("EMOTION_CACHE_DB") or None
+    return PredictionCache(max_bytes=int(max_mb * 1024 * 1024), db_path=db_path)
+
+# Predictor ตัวเดียวต่อ process: ย้าย model ไป device, eval() และจอง buffer ของ input ไว้ครั้งเดียว
+@st.cache_resource
+def get_predictor(_model, _device):
+    return Predictor(_model, class_names, _device)
+
+# Grad-CAM: hook ที่ชั้น conv สุดท้ายครั้งเดียวตอนโหลดโมเดล (None สำหรับ ONNX / int8 / ensemble)
+@st.cache_resource
+def get_gradcam(_model):
+    from gradcam import build_gradcam
+    return build_gradcam(_model)
+
+# Scheduler ตัวเดียวต่อ process ใช้ร่วมกับทุก session
+@st.cache_resource
+def get_microbatcher(_model, _device):
+    from microbatch import MicroBatcher
+    return MicroBatcher(_model, _device, max_batch_size=MICROBATCH_SIZE, max_wait_ms=MICROBATCH_WAIT_MS)
+
+# Prometheus exporter หนึ่งตัวต่อ process
+@st.cache_resource
+def start_metrics_exporter(port):
+    from metrics import start_exporter
+    return start_exporter(port)
+
+if METRICS_PORT:
+    try:
+        start_metrics_exporter(int(METRICS_PORT))
+    except OSError as e:
+        st.warning(f"Could not start metrics exporter on port {METRICS_PORT}: {e}")
+
+# เรียกใช้
+model, device, MODEL_ID = load_model()
+prediction_cache = get_prediction_cache()
+predictor = get_predictor(model, device) if model is not None else None
+gradcam = get_gradcam(model) if model is not None else None
+microbatcher = get_microbatcher(model, device) if MICROBATCH and model is not None else None
+# pil กับ cv2 ให้ tensor ต่างกันเล็กน้อย ผลจึงต้องไม่ใช้ cache ร่วมกัน (รวมถึง key ของ Bulk Scoring)
+if model is not None:
+    MODEL_ID += f":{PREPROCESS_BACKEND}"
+
+# ส่วนวิเคราะห์ภาพเดียว: ทุกครั้งที่มีการโต้ตอบ Streamlit จะรันทั้งไฟล์ใหม่ จึง
+# - เก็บภาพที่ decode แล้วและ tensor ที่ preprocess แล้วไว้ใน session ตาม file_id ของ uploader
+# - ปุ่ม Analyze / TTA อยู่ใน fragment ที่ rerun เฉพาะตัวเอง แล้ววาดผลลงช่อง results_slot
+# - ส่วน Bulk Scoring และ Raw EEG เป็น fragment แยกกัน กดปุ่มในส่วนหนึ่งไม่ทำให้ส่วนอื่นรันใหม่
+if 'prediction_done' not in st.session_state:
+    st.session_state.prediction_done = False
+if 'prediction_result' not in st.session_state:
+    st.session_state.prediction_result = None
+
+def get_decoded_upload(uploaded_file):
+    """ภาพที่ decode แล้วของไฟล์ที่อัปโหลด, decode ครั้งเดียวต่อ file_id (เก็บเฉพาะไฟล์ล่าสุดของ session)"""
+    file_id = getattr(uploaded_file, "file_id", None) or f"{uploaded_file.name}:{uploaded_file.size}"
+    upload = st.session_state.get("decoded_upload")
+    if upload is None or upload["file_id"] != file_id:
+        with timed("decode"):
+            image = Image.open(uploaded_file).convert("RGB")
+        upload = {"file_id": file_id, "image": image, "tensor": None, "cache_keys": {}}
+        st.session_state.decoded_upload = upload
+    return upload
+
+def get_upload_tensor(upload, uploaded_file):
+    """tensor CHW ที่ preprocess แล้ว สร้างครั้งแรกที่กด Analyze แล้วใช้ซ้ำ (TTA, micro-batch, กดซ้ำ)"""
+    if upload["tensor"] is None:
+        with timed("upload_preprocess"):
+            if PREPROCESS_BACKEND == "cv2":
+                upload["tensor"] = preprocess_cv2(uploaded_file.getvalue())
+            else:
+                upload["tensor"] = build_transform((224, 224))(upload["image"])
+    return upload["tensor"]
+
+def get_upload_cache_key(upload, uploaded_file, model_id):
+    """key ของ prediction cache (hash ของ bytes) คำนวณครั้งเดียวต่อไฟล์และ model id"""
+    if model_id not in upload["cache_keys"]:
+        upload["cache_keys"][model_id] = make_key(uploaded_file.getvalue(), model_id)
+    return upload["cache_keys"][model_id]
+
+def get_history():
+    """ประวัติการทำนายของ session นี้ (float16 matrix ขนาดคงที่ ดู history.py)"""
+    if "history" not in st.session_state:
+        from history import PredictionHistory
+        st.session_state.history = PredictionHistory(class_names, capacity=HISTORY_MAX)
+    return st.session_state.history
+
+def render_history(history):
+    """สรุปผลทั้ง session: จำนวนแต่ละคลาส, histogram ของความมั่นใจ และผลล่าสุด"""
+    if not len(history):
+        return
+    import pandas as pd
+
+    st.markdown("---")
+    st.markdown("## Session History")
+    kept = f", showing the last {len(history)}" if history.total_added > len(history) else ""
+    st.caption(f"{history.total_added} predictions this session{kept} ({history.nbytes / 1024:.1f} KB)")
+
+    hist_col1, hist_col2 = st.columns(2)
+    with hist_col1:
+        st.markdown("**Class distribution**")
+        st.bar_chart(pd.DataFrame({"predictions": history.class_counts()}, index=class_names))
+    with hist_col2:
+        st.markdown("**Confidence**")
+        edges, counts = history.confidence_histogram()
+        labels = [f"{lo * 100:.0f}-{hi * 100:.0f}%" for lo, hi in zip(edges[:-1], edges[1:])]
+        st.bar_chart(pd.DataFrame({"predictions": counts}, index=labels))
+
+    recent = pd.DataFrame(history.recent(10))
+    recent["time"] = pd.to_datetime(recent["time"], unit="s").dt.strftime("%H:%M:%S")
+    st.dataframe(recent, use_container_width=True, hide_index=True)
+
+emoji_map = {'Fear': '😨', 'Happy': '😊', 'Neutral': '😐', 'Sad': '😢'}
+color_map = {'Fear': 'emotion-fear', 'Happy': 'emotion-happy',
+             'Neutral': 'emotion-neutral', 'Sad': 'emotion-sad'}
+
+# donut chart ขึ้นกับความน่าจะเป็นเท่านั้น จึงสร้าง go.Figure ครั้งเดียวต่อผลลัพธ์
+@st.cache_resource(max_entries=64)
+def build_donut(probs):
+    import plotly.graph_objects as go
+
+    # Create a donut chart with brand colors
+    fig = go.Figure(data=[go.Pie(
+        labels=[f"{emoji_map[emotion]} {emotion}" for emotion in class_names],
+        values=[prob * 100 for prob in probs],
+        hole=.3,
+        marker_colors=["#254e94", '#4caf50', '#607d8b', '#5897c2']
+    )])
+
+    fig.update_traces(textposition='inside', textinfo='percent+label')
+    fig.update_layout(
+        title="Emotion Distribution",
+        annotations=[dict(text='Confidence', x=0.5, y=0.5, font_size=16, showarrow=False)],
+        height=400,
+        showlegend=False,
+        plot_bgcolor='rgba(0,0,0,0)',
+        paper_bgcolor='rgba(0,0,0,0)',
+        font=dict(color='white')
+    )
+
+    return fig
+
+def render_results(result):
+    """วาดผลลัพธ์ (การ์ดแต่ละอารมณ์, donut chart, ระดับความมั่นใจ) จาก prediction_result"""
+    st.markdown("---")
     
-    # สร้างโมเดล
-    model = timm.create_model('efficientnet_b3', pretrained=False, num_classes=4)
+    # ดึงผลลัพธ์จาก session state
+    predicted_class = result['predicted_class']
+    confidence = result['confidence']
+    all_probs = result['all_probs']
     
-    # map key ให้ตรง (ลบ prefix 'model.' ที่ Lightning ชอบใส่)
-    new_state_dict = OrderedDict()
-    for k, v in state_dict.items():
-        new_key = k.replace("model.", "")
-        new_state_dict[new_key] = v
+    # Results Section
+    st.markdown("## Prediction Results")
     
-    # โหลดน้ำหนัก
+    # Create two columns for results
+    result_col1, result_col2 = st.columns([2, 1])
+
+    with result_col1, timed("render_cards"):
+        #st.markdown('<div class="prediction-card">', unsafe_allow_html=True)
+        
+        max_index = np.argmax(all_probs)
+        
+        # Display results with styling
+        for i, (emotion, prob) in enumerate(zip(class_names, all_probs)):
+            emoji = emoji_map[emotion]
+            percentage = prob * 100
+            is_max = (i == max_index)
+
+            # Create styled result
+            if is_max:
+                st.markdown(f"""
+                <div class="emotion-result {color_map[emotion]}" style="border: 3px solid gold;">
+                    <h3 style="margin:0; color: white; text-shadow: 1px 1px 2px rgba(0,0,0,0.5);">
+                        {emoji} <strong>{emotion}</strong>: {percentage:.1f}%
+                    </h3>
+                    <p style="margin:0; color: white; font-size: 0.9em;">Primary Detection</p>
+                </div>
+                """, unsafe_allow_html=True)
+            else:
+                st.markdown(f"""
+                <div style="padding: 0.5rem; margin: 0.3rem 0; background: rgba(255,255,255,0.1); border-radius: 8px; border-left: 4px solid #5897c2;">
+                    <span style="font-size: 1.1em; color: #e0e0e0;">{emoji} {emotion}: <strong>{percentage:.1f}%</strong></span>
+                </div>
+                """, unsafe_allow_html=True)
+
+        #st.markdown('</div>', unsafe_allow_html=True)
+
+    with result_col2, timed("render_chart"):
+        fig = build_donut(tuple(float(p) for p in all_probs))
+        st.plotly_chart(fig, use_container_width=True)
+        
+    # Confidence indicator
+    max_confidence = all_probs[max_index] * 100
+    if max_confidence > 80:
+        confidence_color = "#4caf50"
+        confidence_text = "High Confidence"
+    elif max_confidence > 60:
+        confidence_color = "#5897c2"
+        confidence_text = "Medium Confidence"
+    else:
+        confidence_color = "#f44336"
+        confidence_text = "Low Confidence"
+
+    st.markdown(f"""
+    <div style="text-align: center; margin: 2rem 0;">
+        <span style="background: {confidence_color}; color: white; padding: 0.5rem 1rem; 
+        border-radius: 20px; font-weight: bold;">
+            🎯 {confidence_text}: {max_confidence:.1f}%
+        </span>
+    </div>
+    """, unsafe_allow_html=True)
+
+@st.fragment
+def analyze_area(upload, uploaded_image):
+    use_tta = st.checkbox(f"Test-time augmentation ({TTA_NUM_VIEWS} views, one batched pass)",
+                          help="Averages predictions over time-shifted and intensity-jittered views")
+
+    if st.button("Analyze Emotion", type="primary", width='stretch',use_container_width=True):
+        with st.spinner("Analyzing emotions..."):
+            if model is not None:
+                try:
+                    # ถ้าเคยทำนายไฟล์นี้แล้วให้ใช้ผลจาก cache
+                    cache_key = get_upload_cache_key(upload, uploaded_image, MODEL_ID + (":tta" if use_tta else ""))
+                    cached = prediction_cache.get(cache_key)
+                    start_time = time.perf_counter()
+                    if cached is not None:
+                        predicted_class, confidence, all_probs = cached
+                    else:
+                        # เรียกใช้ฟังก์ชันทำนาย (tensor ที่ preprocess แล้วถูกเก็บไว้ต่อไฟล์)
+                        model_input = get_upload_tensor(upload, uploaded_image)
+                        if use_tta:
+                            predicted_class, confidence, all_probs = predictor.predict_tta(model_input)
+                        elif microbatcher is not None:
+                            all_probs = microbatcher.predict(model_input, timeout=60)
+                            predicted_idx = int(np.argmax(all_probs))
+                            predicted_class, confidence = class_names[predicted_idx], float(all_probs[predicted_idx])
+                        else:
+                            predicted_class, confidence, all_probs = predictor.predict(model_input)
+                        if predicted_class is not None:
+                            prediction_cache.put(cache_key, predicted_class, confidence, all_probs)
+                    elapsed_ms = (time.perf_counter() - start_time) * 1000
+
+                    if predicted_class is not None:
+                        # เก็บผลลัพธ์ใน session state
+                        st.session_state.prediction_result = {
+                            'predicted_class': predicted_class,
+                            'confidence': confidence,
+                            'all_probs': all_probs,
+                            'file_id': upload["file_id"]
+                        }
+                        st.session_state.prediction_done = True
+                        history = get_history()
+                        history.add(all_probs, uploaded_image.name, "tta" if use_tta else "single")
+                        # fragment rerun: วาดผลใหม่ลงช่องผลลัพธ์ด้านล่างโดยไม่ต้องรันทั้งหน้า
+                        with results_slot.container():
+                            render_results(st.session_state.prediction_result)
+                        with history_slot.container():
+                            render_history(history)
+                        st.success(f"Analysis completed! Predicted: {predicted_class}")
+                        st.info(f"Confidence: {confidence*100:.1f}%")
+                        if cached is None and not use_tta:
+                            st.session_state.single_view_ms = elapsed_ms
+                        if cached is None and use_tta:
+                            # เทียบกับเวลาทำนายแบบภาพเดียวครั้งล่าสุดใน session นี้ (ถ้ามี)
+                            baseline_ms = st.session_state.get('single_view_ms')
+                            added = f" (+{elapsed_ms - baseline_ms:.0f} ms vs single view)" if baseline_ms else ""
+                            st.caption(f"TTA: {TTA_NUM_VIEWS} views in {elapsed_ms:.0f} ms{added}")
+                        if microbatcher is not None:
+                            mb_stats = microbatcher.stats()
+                            st.caption(f"Micro-batching: {mb_stats['batches']} batches, "
+                                       f"mean size {mb_stats['mean_batch_size']:.1f}, "
+                                       f"queue depth {mb_stats['queue_depth']}")
+                    else:
+                        st.error("Failed to analyze emotion")
+
+                except Exception as e:
+                    st.error(f"Error during prediction: {str(e)}")
+            else:
+                st.error("Model not loaded properly")
+
+@st.fragment
+def explain_area(upload, uploaded_image):
+    """Grad-CAM ข้างภาพที่อัปโหลด: ทุกคลาสจาก forward pass เดียว, cache ตาม hash ของไฟล์"""
+    if gradcam is None:
+        if model is not None:
+            st.caption("Grad-CAM needs the PyTorch backend (not ONNX, int8 or a fold ensemble)")
+        return
+    if not st.toggle("Explain with Grad-CAM",
+                     help="Highlights the time-frequency regions that drove each class"):
+        return
     try:
-        model.load_state_dict(new_state_dict, strict=False)
-        model.to(device)
-        model.eval()
-        return model, device
+        with timed("gradcam"):
+            cams, probs = gradcam.explain(get_upload_tensor(upload, uploaded_image),
+                                          key=get_upload_cache_key(upload, uploaded_image, MODEL_ID + ":gradcam"))
     except Exception as e:
-        st.error(f"Error loading model: {e}")
-        return None, device
-       
-
-# เรียกใช้
-model, device = load_model()
+        st.error(f"Error computing Grad-CAM: {str(e)}")
+        return
+    selected = st.radio("Class", class_names, index=int(probs.argmax()), horizontal=True,
+                        format_func=lambda c: f"{emoji_map[c]} {c} ({probs[class_names.index(c)] * 100:.0f}%)")
+    overlays = upload.setdefault("gradcam_overlays", {})
+    if selected not in overlays:
+        from gradcam import overlay
+        # ซ้อนบนภาพขนาดที่แสดงผล ไม่ใช่ภาพเต็ม เพื่อไม่ให้ session เก็บภาพใหญ่หลายภาพ
+        base = upload["image"]
+        if base.width > 550:
+            base = base.resize((550, max(1, round(base.height * 550 / base.width))), Image.BILINEAR)
+        with timed("gradcam_overlay"):
+            overlays[selected] = overlay(base, cams[class_names.index(selected)])
+    st.image(overlays[selected], caption=f"Grad-CAM: {selected}", width=550, use_container_width=False)
 
 # Main Content Area
 col1, col2 = st.columns([1, 1])
+# ช่องผลลัพธ์ใต้สองคอลัมน์ (ถูกแทนที่ทั้งจาก full rerun และจาก fragment ของปุ่ม Analyze)
+results_slot = st.empty()
+# ช่องประวัติของ session (อัปเดตจากปุ่ม Analyze และ Analyze All)
+history_slot = st.empty()
 
 with col1:
     st.markdown("""
@@ -1142,10 +1473,12 @@ with col1:
     # สร้างตัวแปร uploaded_image สำหรับการอัปโหลดไฟล์
     uploaded_image = st.file_uploader("Choose an image...", type=["jpg", "jpeg", "png"], label_visibility="collapsed")
     
-    # แสดงภาพเฉพาะในคอลัมน์แรก
+    # แสดงภาพเฉพาะในคอลัมน์แรก (decode ครั้งเดียวต่อไฟล์ ไม่ใช่ทุกครั้งที่ rerun)
+    upload = None
     image = None
     if uploaded_image is not None:
-        image = Image.open(uploaded_image).convert("RGB")
+        upload = get_decoded_upload(uploaded_image)
+        image = upload["image"]
         #st.image(image, caption="Uploaded Image", use_container_width=True)
         st.image(image, caption="Uploaded Image", width = 550, use_container_width=False)
 
@@ -1198,34 +1531,8 @@ with col2:
         
         # ปุ่มสำหรับวิเคราะห์อารมณ์
         st.markdown("<br>", unsafe_allow_html=True)
-        # ใช้ session state เพื่อจัดการการแสดงผล
-        if 'prediction_done' not in st.session_state:
-            st.session_state.prediction_done = False
-            
-        if st.button("Analyze Emotion", type="primary", width='stretch',use_container_width=True):
-            with st.spinner("Analyzing emotions..."):
-                if model is not None:
-                    try:
-                        # เรียกใช้ฟังก์ชันทำนาย
-                        predicted_class, confidence, all_probs = pred_class(model, image, class_names, device)
-                        
-                        if predicted_class is not None:
-                            # เก็บผลลัพธ์ใน session state
-                            st.session_state.prediction_result = {
-                                'predicted_class': predicted_class,
-                                'confidence': confidence,
-                                'all_probs': all_probs
-                            }
-                            st.session_state.prediction_done = True
-                            st.success(f"Analysis completed! Predicted: {predicted_class}")
-                            st.info(f"Confidence: {confidence*100:.1f}%")
-                        else:
-                            st.error("Failed to analyze emotion")
-                            
-                    except Exception as e:
-                        st.error(f"Error during prediction: {str(e)}")
-                else:
-                    st.error("Model not loaded properly")
+        analyze_area(upload, uploaded_image)
+        explain_area(upload, uploaded_image)
     else:
         st.markdown("""
         <div style="
@@ -1243,105 +1550,147 @@ with col2:
         </div>
         """, unsafe_allow_html=True)
 
-
-# Initialize session state
-if 'prediction_done' not in st.session_state:
-    st.session_state.prediction_done = False
-if 'prediction_result' not in st.session_state:
-    st.session_state.prediction_result = None
-    
-# Prediction Section
-if uploaded_image is not None and model is not None and st.session_state.prediction_done and st.session_state.prediction_result is not None:
+# Prediction Section: full rerun วาดผลล่าสุดของไฟล์ที่แสดงอยู่
+# (กดปุ่มใน fragment จะ rerun เฉพาะ fragment ส่วนนี้จึงไม่ถูกรัน fragment เป็นผู้วาดลง slot เพียงที่เดียว)
+result = st.session_state.prediction_result
+if upload is not None and model is not None and st.session_state.prediction_done and result is not None \
+        and result.get('file_id') == upload["file_id"]:
+    with results_slot.container():
+        render_results(result)
+with history_slot.container():
+    render_history(get_history())
+
+# Bulk Scoring Section
+@st.fragment
+def bulk_scoring_section():
     st.markdown("---")
-    
-    # ดึงผลลัพธ์จาก session state
-    result = st.session_state.prediction_result
-    predicted_class = result['predicted_class']
-    confidence = result['confidence']
-    all_probs = result['all_probs']
-    
-    emoji_map = {'Fear': '😨', 'Happy': '😊', 'Neutral': '😐', 'Sad': '😢'}
-    color_map = {'Fear': 'emotion-fear', 'Happy': 'emotion-happy',
-                 'Neutral': 'emotion-neutral', 'Sad': 'emotion-sad'}
-    
-    # Results Section
-    st.markdown("## Prediction Results")
-    
-    # Create two columns for results
-    result_col1, result_col2 = st.columns([2, 1])
-
-    with result_col1:
-        #st.markdown('<div class="prediction-card">', unsafe_allow_html=True)
-        
-        max_index = np.argmax(all_probs)
-        
-        # Display results with styling
-        for i, (emotion, prob) in enumerate(zip(class_names, all_probs)):
-            emoji = emoji_map[emotion]
-            percentage = prob * 100
-            is_max = (i == max_index)
-
-            # Create styled result
-            if is_max:
-                st.markdown(f"""
-                <div class="emotion-result {color_map[emotion]}" style="border: 3px solid gold;">
-                    <h3 style="margin:0; color: white; text-shadow: 1px 1px 2px rgba(0,0,0,0.5);">
-                        {emoji} <strong>{emotion}</strong>: {percentage:.1f}%
-                    </h3>
-                    <p style="margin:0; color: white; font-size: 0.9em;">Primary Detection</p>
-                </div>
-                """, unsafe_allow_html=True)
-            else:
-                st.markdown(f"""
-                <div style="padding: 0.5rem; margin: 0.3rem 0; background: rgba(255,255,255,0.1); border-radius: 8px; border-left: 4px solid #5897c2;">
-                    <span style="font-size: 1.1em; color: #e0e0e0;">{emoji} {emotion}: <strong>{percentage:.1f}%</strong></span>
-                </div>
-                """, unsafe_allow_html=True)
-
-        #st.markdown('</div>', unsafe_allow_html=True)
+    st.markdown("## Bulk Scoring")
+
+    bulk_files = st.file_uploader("Choose spectrogram images...", type=["jpg", "jpeg", "png"],
+                                  accept_multiple_files=True, key="bulk_uploader")
+    bulk_batch_size = st.select_slider("Batch size", options=[8, 16, 32, 64, 128], value=32)
+
+    # ผลลัพธ์ผูกกับชุดไฟล์ที่อัปโหลด ถ้าชุดไฟล์เปลี่ยนให้ล้างตารางเก่าทิ้ง
+    bulk_file_ids = tuple(f.file_id for f in bulk_files or [])
+    if st.session_state.get('bulk_result_ids') != bulk_file_ids:
+        st.session_state.bulk_result = None
+        st.session_state.bulk_result_ids = bulk_file_ids
+
+    if bulk_files and st.button("Analyze All", type="primary", use_container_width=True):
+        if model is None:
+            st.error("Model not loaded properly")
+        else:
+            with st.spinner(f"Analyzing {len(bulk_files)} images..."):
+                try:
+                    bulk_probs = np.zeros((len(bulk_files), len(class_names)), dtype=np.float32)
+                    bulk_keys = [make_key(f.getvalue(), MODEL_ID) for f in bulk_files]
+                    misses = []
+                    for i, key in enumerate(bulk_keys):
+                        cached = prediction_cache.get(key)
+                        if cached is not None:
+                            bulk_probs[i] = cached[2]
+                        else:
+                            misses.append(i)
 
-    with result_col2:
-        # Create a donut chart with brand colors
-        fig = go.Figure(data=[go.Pie(
-            labels=[f"{emoji_map[emotion]} {emotion}" for emotion in class_names],
-            values=[prob * 100 for prob in all_probs],
-            hole=.3,
-            marker_colors=["#254e94", '#4caf50', '#607d8b', '#5897c2']
-        )])
-
-        fig.update_traces(textposition='inside', textinfo='percent+label')
-        fig.update_layout(
-            title="Emotion Distribution",
-            annotations=[dict(text='Confidence', x=0.5, y=0.5, font_size=16, showarrow=False)],
-            height=400,
-            showlegend=False,
-            plot_bgcolor='rgba(0,0,0,0)',
-            paper_bgcolor='rgba(0,0,0,0)',
-            font=dict(color='white')
+                    if misses:
+                        # ถอดรหัสภาพแบบ lazy ทีละ batch ไม่ต้องโหลดทั้งหมดเข้าหน่วยความจำ
+                        if PREPROCESS_BACKEND == "cv2":
+                            images = (preprocess_cv2(bulk_files[i].getvalue()) for i in misses)
+                        else:
+                            images = (Image.open(bulk_files[i]).convert("RGB") for i in misses)
+                        miss_probs = predictor.predict_proba(images, batch_size=bulk_batch_size)
+                        bulk_probs[misses] = miss_probs
+                        for i, probs in zip(misses, miss_probs):
+                            idx = int(probs.argmax())
+                            prediction_cache.put(bulk_keys[i], class_names[idx], probs[idx], probs)
+                    import pandas as pd
+                    bulk_df = pd.DataFrame(bulk_probs, columns=class_names)
+                    bulk_df.insert(0, "predicted_class", np.asarray(class_names)[bulk_probs.argmax(axis=1)])
+                    bulk_df.insert(0, "file", [f.name for f in bulk_files])
+                    st.session_state.bulk_result = bulk_df
+                    history = get_history()
+                    history.add_batch(bulk_probs, [f.name for f in bulk_files], "bulk")
+                    with history_slot.container():
+                        render_history(history)
+                except Exception as e:
+                    st.error(f"Error during bulk prediction: {str(e)}")
+
+    if st.session_state.get('bulk_result') is not None:
+        bulk_df = st.session_state.bulk_result
+        st.dataframe(
+            bulk_df,
+            use_container_width=True,
+            hide_index=True,
+            column_config={
+                name: st.column_config.ProgressColumn(name, format="%.3f", min_value=0.0, max_value=1.0)
+                for name in class_names
+            },
+        )
+        cache_stats = prediction_cache.stats()
+        st.caption(
+            f"Cache: {cache_stats['memory_hits']} memory hits, {cache_stats['disk_hits']} disk hits, "
+            f"{cache_stats['misses']} misses ({cache_stats['hit_rate']*100:.0f}% hit rate)"
+        )
+        st.download_button(
+            "Download CSV",
+            data=bulk_df.to_csv(index=False).encode("utf-8"),
+            file_name="emotion_predictions.csv",
+            mime="text/csv",
         )
 
-        st.plotly_chart(fig, use_container_width=True)
-        
-    # Confidence indicator
-    max_confidence = all_probs[max_index] * 100
-    if max_confidence > 80:
-        confidence_color = "#4caf50"
-        confidence_text = "High Confidence"
-    elif max_confidence > 60:
-        confidence_color = "#5897c2"
-        confidence_text = "Medium Confidence"
-    else:
-        confidence_color = "#f44336"
-        confidence_text = "Low Confidence"
+bulk_scoring_section()
 
-    st.markdown(f"""
-    <div style="text-align: center; margin: 2rem 0;">
-        <span style="background: {confidence_color}; color: white; padding: 0.5rem 1rem; 
-        border-radius: 20px; font-weight: bold;">
-            🎯 {confidence_text}: {max_confidence:.1f}%
-        </span>
-    </div>
-    """, unsafe_allow_html=True)
+# Raw EEG Section
+@st.fragment
+def raw_eeg_section():
+    st.markdown("---")
+    st.markdown("## Raw EEG")
+
+    eeg_file = st.file_uploader("Choose a raw EEG recording (.npy or .csv, channels x samples)...",
+                                type=["npy", "csv"], key="eeg_uploader")
+    eeg_col1, eeg_col2 = st.columns(2)
+    with eeg_col1:
+        eeg_fs = st.number_input("Sampling rate (Hz)", min_value=1.0, value=128.0, step=1.0)
+    with eeg_col2:
+        eeg_segment = st.number_input("Segment length (s, 0 = whole recording)", min_value=0.0, value=10.0, step=1.0)
+
+    if eeg_file is not None and st.button("Analyze EEG", type="primary", use_container_width=True):
+        if model is None:
+            st.error("Model not loaded properly")
+        else:
+            with st.spinner("Computing spectrograms and analyzing..."):
+                try:
+                    from eeg import eeg_to_tensors, load_eeg
+                    import pandas as pd
+
+                    # STFT แบบ vectorized แล้วส่ง tensor เข้าโมเดลตรงๆ ไม่ต้อง encode/decode เป็น PNG
+                    eeg_signal = load_eeg(eeg_file.getvalue(), eeg_file.name)
+                    eeg_inputs = eeg_to_tensors(eeg_signal, eeg_fs, segment_seconds=eeg_segment or None)
+                    eeg_probs = predictor.predict_proba(eeg_inputs)
+
+                    seg_seconds = eeg_segment or eeg_signal.shape[1] / eeg_fs
+                    eeg_df = pd.DataFrame(eeg_probs, columns=class_names)
+                    eeg_df.insert(0, "predicted_class", np.asarray(class_names)[eeg_probs.argmax(axis=1)])
+                    eeg_df.insert(0, "start_s", np.arange(len(eeg_probs)) * seg_seconds)
+                    st.caption(f"{eeg_signal.shape[0]} channels, {eeg_signal.shape[1] / eeg_fs:.1f} s, "
+                               f"{len(eeg_probs)} segments")
+                    st.line_chart(eeg_df.set_index("start_s")[class_names])
+                    st.dataframe(eeg_df, use_container_width=True, hide_index=True)
+                except Exception as e:
+                    st.error(f"Error during EEG analysis: {str(e)}")
+
+raw_eeg_section()
+
+# Debug panel: percentiles ของเวลาแต่ละขั้นตอน (upload → predict → render)
+if DEBUG_PANEL or st.query_params.get("debug") == "1":
+    with st.expander("Performance debug", expanded=False):
+        stage_stats = METRICS.snapshot()
+        if stage_stats:
+            import pandas as pd
+            st.table(pd.DataFrame.from_dict(stage_stats, orient="index").round(2))
+        else:
+            st.caption("No timings recorded yet")
+        st.code(METRICS.prometheus_text(), language="text")
 
 # Footer with enhanced styling
 st.markdown("---")
@@ -0,0 +1,220 @@
+## Checksum-verified, resumable model artifact fetch with a shared local cache
+import fcntl
+import hashlib
+import os
+import re
+import shutil
+import urllib.request
+from contextlib import contextmanager
+from typing import List, Optional, Sequence, Tuple
+
+# Values from the Git LFS pointer committed for the fold-1 checkpoint
+MODEL_FILENAME = "efficientnet_b3_checkpoint_fold1.pt"
+MODEL_SHA256 = "6f7e21816c76c0546dff8b0e7981f15c4896668e6002dcf8cacdd6d6fefa6d88"
+MODEL_SIZE = 43466535
+MODEL_GDRIVE_ID = "1TUVnEHkl3fd-5olrDR-wTlkGFKakAIaB"
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class ArtifactError(RuntimeError):
+    pass
+
+
+def default_cache_dir() -> str:
+    return os.environ.get("EMOTION_ARTIFACT_CACHE",
+                          os.path.join(os.path.expanduser("~"), ".cache", "emotion-app"))
+
+
+def parse_lfs_pointer(path: str) -> Optional[Tuple[str, int]]:
+    """(sha256, size) if `path` is a Git LFS pointer file, else None."""
+    try:
+        if os.path.getsize(path) > 1024:
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            text = f.read()
+    except (OSError, UnicodeDecodeError):
+        return None
+    if not text.startswith("version https://git-lfs"):
+        return None
+    fields = dict(line.split(" ", 1) for line in text.splitlines() if " " in line)
+    return fields["oid"].split(":", 1)[1].strip(), int(fields["size"])
+
+
+class HttpSource:
+    """Plain HTTP(S) URL; resumes with a Range request when the server supports it."""
+
+    def __init__(self, url: str, timeout: float = 60.0):
+        self.url = url
+        self.timeout = timeout
+
+    def download(self, part_path: str):
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        request = urllib.request.Request(self.url)
+        if offset:
+            request.add_header("Range", f"bytes={offset}-")
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            # 200 means the Range header was ignored: start over
+            mode = "ab" if offset and response.status == 206 else "wb"
+            with open(part_path, mode) as f:
+                shutil.copyfileobj(response, f, CHUNK_SIZE)
+
+    def __repr__(self):
+        return f"HttpSource({self.url!r})"
+
+
+class GDriveSource:
+    """Google Drive file via gdown (which handles the confirm page and resume)."""
+
+    def __init__(self, file_id: str):
+        self.file_id = file_id
+
+    def download(self, part_path: str):
+        import gdown
+
+        url = f"https://drive.google.com/uc?id={self.file_id}"
+        # gdown "skips" any existing output, so a short .part left by another source would
+        # stay as it is; it writes (and resumes) its own file, which then replaces the .part
+        output = part_path + ".gdown"
+        if gdown.download(url, output, quiet=False, resume=True) is None:
+            raise ArtifactError(f"gdown could not fetch {url}")
+        os.replace(output, part_path)
+
+    def __repr__(self):
+        return f"GDriveSource({self.file_id!r})"
+
+
+class LocalFileSource:
+    """Copy from a local path or mount, resuming at the partial file's size."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def download(self, part_path: str):
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        with open(self.path, "rb") as src, open(part_path, "ab") as dst:
+            src.seek(offset)
+            shutil.copyfileobj(src, dst, CHUNK_SIZE)
+
+    def __repr__(self):
+        return f"LocalFileSource({self.path!r})"
+
+
+def sha256_file(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+@contextmanager
+def _file_lock(path: str):
+    with open(path, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _verified(path: str, sha256: str, size: int) -> bool:
+    """Full hash check once, then a marker keyed on mtime and size makes later checks free."""
+    if not os.path.exists(path) or os.path.getsize(path) != size:
+        return False
+    marker = path + ".verified"
+    stamp = f"{sha256} {os.path.getmtime(path)} {size}"
+    if os.path.exists(marker):
+        with open(marker) as f:
+            if f.read() == stamp:
+                return True
+    if sha256_file(path) != sha256:
+        return False
+    try:
+        with open(marker, "w") as f:
+            f.write(stamp)
+    except OSError:
+        # read-only location: still verified, just hashed again next time
+        pass
+    return True
+
+
+def resolve_artifact(name: str, sha256: str, size: int, sources: Sequence,
+                     cache_dir: Optional[str] = None) -> str:
+    """Path to a verified copy of the artifact, downloading into the shared cache if needed.
+
+    Concurrent callers (Streamlit workers, server processes) serialize on a
+    file lock so only one downloads; the rest wait and reuse the result.
+    Interrupted downloads resume from the `.part` file, and nothing is moved
+    into place unless its size and sha256 match.
+    """
+    cache_dir = cache_dir or default_cache_dir()
+    os.makedirs(cache_dir, exist_ok=True)
+    final_path = os.path.join(cache_dir, f"{sha256[:16]}-{name}")
+    if _verified(final_path, sha256, size):
+        return final_path
+
+    part_path = final_path + ".part"
+    errors: List[str] = []
+    with _file_lock(final_path + ".lock"):
+        # another process may have finished while we waited for the lock
+        if _verified(final_path, sha256, size):
+            return final_path
+
+        # a crash between download and os.replace leaves a complete .part; resuming it with
+        # a Range request would get 416 on every attempt, so only its hash needs checking
+        if os.path.exists(part_path) and os.path.getsize(part_path) == size:
+            if sha256_file(part_path) == sha256:
+                os.replace(part_path, final_path)
+                _verified(final_path, sha256, size)
+                return final_path
+            os.remove(part_path)
+
+        for source in sources:
+            try:
+                if os.path.exists(part_path) and os.path.getsize(part_path) > size:
+                    os.remove(part_path)
+                source.download(part_path)
+            except Exception as e:
+                errors.append(f"{source!r}: {e}")
+                continue
+
+            actual_size = os.path.getsize(part_path)
+            if actual_size != size:
+                errors.append(f"{source!r}: got {actual_size} bytes, expected {size}")
+                continue
+            if sha256_file(part_path) != sha256:
+                errors.append(f"{source!r}: sha256 mismatch")
+                os.remove(part_path)
+                continue
+            os.replace(part_path, final_path)
+            _verified(final_path, sha256, size)
+            return final_path
+
+    raise ArtifactError(f"Could not fetch {name}: " + "; ".join(errors or ["no sources"]))
+
+
+def mirror_sources(value: str) -> List:
+    """Sources for a comma/whitespace separated list of URLs and local paths.
+
+    Not os.pathsep: on POSIX that is ":", which would cut "http://host:port/..." apart.
+    """
+    return [HttpSource(m) if m.startswith(("http://", "https://")) else LocalFileSource(m)
+            for m in re.split(r"[,\s]+", value) if m]
+
+
+def resolve_model_checkpoint(model_path: str = MODEL_FILENAME, sources: Optional[Sequence] = None,
+                             cache_dir: Optional[str] = None) -> str:
+    """Real checkpoint path for `model_path`, which may be missing or a Git LFS pointer."""
+    pointer = parse_lfs_pointer(model_path) if os.path.exists(model_path) else None
+    if os.path.exists(model_path) and pointer is None:
+        # the old direct gdown download wrote this name in place and could leave a partial
+        # file behind, so the default checkpoint is only trusted once it matches the pinned hash
+        if os.path.basename(model_path) != MODEL_FILENAME or _verified(model_path, MODEL_SHA256, MODEL_SIZE):
+            return model_path
+    sha256, size = pointer or (MODEL_SHA256, MODEL_SIZE)
+    if sources is None:
+        # EMOTION_ARTIFACT_MIRRORS: extra sources tried first, URLs or local paths, separated by "," or spaces
+        sources = mirror_sources(os.environ.get("EMOTION_ARTIFACT_MIRRORS", ""))
+        sources.append(GDriveSource(MODEL_GDRIVE_ID))
+    return resolve_artifact(os.path.basename(model_path), sha256, size, sources, cache_dir)
@@ -0,0 +1,327 @@
+## Headless benchmarks: imports, cold start, per-image latency, batch throughput
+import argparse
+import ast
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from typing import List, Optional
+
+import numpy as np
+
+# Modules app.py pulls in (directly or through prediction.py)
+APP_IMPORTS = [
+    "streamlit", "torch", "torchvision", "timm", "lightning.fabric.wrappers",
+    "plotly.graph_objects", "pandas", "numpy", "PIL.Image", "gdown", "cv2",
+]
+
+# Must not be imported at app.py module top or by `import prediction`;
+# they are only needed on rare paths and are loaded on first use.
+LAZY_MODULES = ["gdown", "plotly", "pandas", "timm", "lightning", "pytorch_lightning",
+                "cv2", "onnxruntime", "torchvision"]
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                             cwd=HERE)
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def host_info() -> dict:
+    import torch
+
+    return {
+        "host": platform.node(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "torch_threads": torch.get_num_threads(),
+        "git_commit": _git_commit(),
+    }
+
+
+def bench_imports(modules: List[str] = APP_IMPORTS) -> dict:
+    """Cold import time of each module, each in a fresh interpreter."""
+    probe = "import importlib, sys, time; s = time.perf_counter(); importlib.import_module(sys.argv[1]); print(time.perf_counter() - s)"
+    results = {}
+    for name in modules:
+        out = subprocess.run([sys.executable, "-c", probe, name], capture_output=True, text=True)
+        if out.returncode == 0:
+            results[name] = {"seconds": float(out.stdout.strip().splitlines()[-1])}
+        else:
+            results[name] = {"error": out.stderr.strip().splitlines()[-1] if out.stderr.strip() else "failed"}
+    return results
+
+
+def importtime_report(statement: str = "import prediction, prediction_cache", top: int = 15) -> dict:
+    """Parse `python -X importtime` for `statement`: total time, slowest modules, what got loaded."""
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", statement],
+                         capture_output=True, text=True, cwd=HERE)
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        # "import time: <self us> | <cumulative us> | <2 spaces per nesting level><name>"
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((name[1:].rstrip(), int(self_us), int(cumulative_us)))
+    top_level = [r for r in rows if not r[0].startswith(" ")]
+    return {
+        "statement": statement,
+        "returncode": out.returncode,
+        "total_ms": sum(r[2] for r in top_level) / 1000,
+        "slowest": [{"module": n.strip(), "cumulative_ms": c / 1000}
+                    for n, _, c in sorted(rows, key=lambda r: -r[2])[:top]],
+        "modules": sorted({r[0].strip() for r in rows}),
+    }
+
+
+def _app_top_level_imports(path: str = os.path.join(HERE, "app.py")) -> List[str]:
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    names = []
+    for node in tree.body:  # module level only; imports inside functions are lazy
+        if isinstance(node, ast.Import):
+            names.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module:
+            names.append(node.module)
+    return names
+
+
+def check_imports(budget_ms: Optional[float] = None) -> List[str]:
+    """Regression guard for startup imports; returns a list of problems (empty = ok)."""
+    problems = []
+    for name in _app_top_level_imports():
+        if name.split(".")[0] in LAZY_MODULES:
+            problems.append(f"app.py imports {name} at module level")
+
+    report = importtime_report()
+    if report["returncode"] != 0:
+        problems.append("`import prediction, prediction_cache` failed")
+    for name in report["modules"]:
+        if name.split(".")[0] in LAZY_MODULES:
+            problems.append(f"`import prediction` pulls in {name}")
+    if budget_ms is not None and report["total_ms"] > budget_ms:
+        problems.append(f"`import prediction` took {report['total_ms']:.0f} ms (budget {budget_ms:.0f} ms)")
+    return sorted(set(problems))
+
+
+def bench_load_model(checkpoint: str) -> dict:
+    """load_model wall time and peak RSS (fresh interpreter per loader)."""
+    from convert_checkpoint import FAST_PATH, measure
+
+    results = {"load_checkpoint": measure("load_checkpoint", checkpoint)}
+    if os.path.exists(FAST_PATH):
+        results["load_fast"] = measure("load_fast", FAST_PATH)
+    return results
+
+
+def _percentiles(samples_ms) -> dict:
+    samples_ms = np.asarray(samples_ms)
+    return {
+        "mean": float(samples_ms.mean()),
+        "p50": float(np.percentile(samples_ms, 50)),
+        "p90": float(np.percentile(samples_ms, 90)),
+        "p99": float(np.percentile(samples_ms, 99)),
+        "runs": int(samples_ms.size),
+    }
+
+
+def bench_latency(model, images, class_names, runs: int = 100, warmup: int = 10) -> dict:
+    """Single-image pred_class latency percentiles in milliseconds."""
+    from prediction import pred_class
+
+    timings = []
+    for i in range(warmup + runs):
+        img = images[i % len(images)]
+        start = time.perf_counter()
+        pred_class(model, img, class_names)
+        if i >= warmup:
+            timings.append((time.perf_counter() - start) * 1000)
+    return _percentiles(timings)
+
+
+def bench_throughput(model, images, class_names, batch_sizes: List[int], threads: List[int],
+                     repeats: int = 3) -> List[dict]:
+    """Images/sec of pred_batch over a sweep of batch sizes and intra-op thread counts."""
+    import torch
+    from prediction import pred_batch
+
+    original_threads = torch.get_num_threads()
+    results = []
+    try:
+        for n_threads in threads:
+            torch.set_num_threads(n_threads)
+            for batch_size in batch_sizes:
+                pred_batch(model, images[:batch_size], class_names, batch_size=batch_size)  # warmup
+                best = float("inf")
+                for _ in range(repeats):
+                    start = time.perf_counter()
+                    pred_batch(model, images, class_names, batch_size=batch_size)
+                    best = min(best, time.perf_counter() - start)
+                results.append({
+                    "threads": n_threads,
+                    "batch_size": batch_size,
+                    "images": len(images),
+                    "seconds": best,
+                    "images_per_sec": len(images) / best,
+                })
+    finally:
+        torch.set_num_threads(original_threads)
+    return results
+
+
+def _profile_worker(slot, profile, checkpoint, seconds, n_images, barrier, results):
+    from runtime_profiles import apply_profile
+
+    # first, while torch is not imported yet in this spawned process
+    apply_profile(profile, slot)
+    from fixtures import synthetic_spectrograms
+    from prediction import pred_class
+
+    model = load_bench_model(checkpoint)
+    images = synthetic_spectrograms(n_images, seed=slot)
+    class_names = ["Fear", "Happy", "Neutral", "Sad"]
+    pred_class(model, images[0], class_names)  # warmup
+
+    barrier.wait()
+    timings = []
+    deadline = time.perf_counter() + seconds
+    i = 0
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        pred_class(model, images[i % n_images], class_names)
+        timings.append((time.perf_counter() - start) * 1000)
+        i += 1
+    results.put(timings)
+
+
+def bench_profiles(names: List[str], checkpoint: Optional[str], seconds: float = 10.0,
+                   n_images: int = 16, pin_cpus: bool = False) -> List[dict]:
+    """Run each runtime profile's worker/thread layout concurrently with single-image requests.
+
+    Reports aggregate images/sec (throughput) and per-request latency
+    percentiles (what one user waits), which is the tradeoff between profiles.
+    """
+    import multiprocessing as mp
+    from runtime_profiles import resolve_profile
+
+    ctx = mp.get_context("spawn")  # fresh OpenMP pools per worker
+    results = []
+    for name in names:
+        profile = resolve_profile(name, pin_cpus=pin_cpus)
+        barrier = ctx.Barrier(profile.workers)
+        queue = ctx.Queue()
+        procs = [ctx.Process(target=_profile_worker,
+                             args=(slot, profile, checkpoint, seconds, n_images, barrier, queue))
+                 for slot in range(profile.workers)]
+        for proc in procs:
+            proc.start()
+        timings = [t for _ in procs for t in queue.get()]
+        for proc in procs:
+            proc.join()
+        results.append({
+            "profile": name,
+            "workers": profile.workers,
+            "intra_op_threads": profile.intra_op_threads,
+            "pin_cpus": pin_cpus,
+            "images_per_sec": len(timings) / seconds,
+            "latency_ms": _percentiles(timings),
+        })
+    return results
+
+
+def resolve_bench_checkpoint(checkpoint: Optional[str]) -> Optional[str]:
+    """Real checkpoint path (fetching it if the tree only has the LFS pointer), or None for random weights."""
+    from artifacts import ArtifactError, resolve_model_checkpoint
+
+    if not checkpoint:
+        return None
+    try:
+        return resolve_model_checkpoint(checkpoint)
+    except (ArtifactError, OSError) as e:
+        print(f"Could not resolve {checkpoint} ({e}); benchmarking random weights", file=sys.stderr)
+        return None
+
+
+def load_bench_model(checkpoint: Optional[str]):
+    """The served model, or same-architecture random weights when no checkpoint is given."""
+    import timm
+    from prediction import load_checkpoint
+
+    if checkpoint:
+        return load_checkpoint(checkpoint, "cpu")
+    return timm.create_model('efficientnet_b3', pretrained=False, num_classes=4).eval()
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v]
+
+
+def main():
+    from fixtures import synthetic_spectrograms
+
+    parser = argparse.ArgumentParser(description="Benchmark model loading and inference without Streamlit.")
+    parser.add_argument("--checkpoint", default="efficientnet_b3_checkpoint_fold1.pt",
+                        help="checkpoint to load; pass '' to benchmark random weights")
+    parser.add_argument("--images", type=int, default=64, help="number of synthetic spectrograms")
+    parser.add_argument("--runs", type=int, default=100, help="single-image latency runs")
+    parser.add_argument("--batch-sizes", type=_int_list, default=[1, 4, 8, 16, 32])
+    parser.add_argument("--threads", type=_int_list, default=sorted({1, 2, 4, os.cpu_count() or 1}))
+    parser.add_argument("--skip", default="", help="comma separated: imports,load,latency,throughput")
+    parser.add_argument("--out", default=None, help="write JSON here (default: stdout)")
+    parser.add_argument("--profiles", default="",
+                        help="comma separated runtime profiles to compare, e.g. latency,throughput")
+    parser.add_argument("--profile-seconds", type=float, default=10.0)
+    parser.add_argument("--pin-cpus", action="store_true")
+    parser.add_argument("--check-imports", action="store_true",
+                        help="only run the startup import guard; exit 1 on regressions")
+    parser.add_argument("--import-budget-ms", type=float, default=None)
+    args = parser.parse_args()
+
+    if args.check_imports:
+        problems = check_imports(args.import_budget_ms)
+        print(json.dumps({"import_time": importtime_report(), "problems": problems}, indent=2))
+        raise SystemExit(1 if problems else 0)
+
+    skip = set(args.skip.split(","))
+    class_names = ["Fear", "Happy", "Neutral", "Sad"]
+    checkpoint = resolve_bench_checkpoint(args.checkpoint)
+
+    report = {"host": host_info(), "timestamp": time.time()}
+    if "imports" not in skip:
+        report["imports"] = bench_imports()
+        report["import_time"] = importtime_report()
+    if "load" not in skip and checkpoint:
+        report["load_model"] = bench_load_model(checkpoint)
+
+    if not {"latency", "throughput"} <= skip:
+        model = load_bench_model(checkpoint)
+        report["weights"] = checkpoint or "random"
+        images = synthetic_spectrograms(args.images)
+        if "latency" not in skip:
+            report["latency_ms"] = bench_latency(model, images, class_names, runs=args.runs)
+        if "throughput" not in skip:
+            report["throughput"] = bench_throughput(model, images, class_names, args.batch_sizes, args.threads)
+
+    if args.profiles:
+        report["profiles"] = bench_profiles(args.profiles.split(","), checkpoint,
+                                            seconds=args.profile_seconds, pin_cpus=args.pin_cpus)
+
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+## One-time conversion of the Lightning checkpoint to a flat safetensors file
+import argparse
+import json
+import subprocess
+import sys
+
+FAST_PATH = "efficientnet_b3_fold1.safetensors"
+
+# Run each loader in a fresh interpreter so timings and peak RSS are cold
+_PROBE = """
+import json, resource, sys, time
+start = time.perf_counter()
+import prediction
+loader = getattr(prediction, sys.argv[1])
+loader(sys.argv[2], "cpu")
+elapsed = time.perf_counter() - start
+peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({"seconds": elapsed, "peak_rss_mb": peak_kb / 1024}))
+"""
+
+
+def convert(model_path: str, out_path: str = FAST_PATH) -> str:
+    """Write the remapped state_dict (no 'model.' prefix) as safetensors."""
+    from safetensors.torch import save_file
+    from prediction import read_state_dict
+
+    state_dict = read_state_dict(model_path)
+    # safetensors needs contiguous tensors that don't share storage
+    flat = {k: v.detach().clone().contiguous() for k, v in state_dict.items()}
+    save_file(flat, out_path, metadata={"arch": "efficientnet_b3", "source": model_path})
+    return out_path
+
+
+def measure(loader: str, path: str) -> dict:
+    """Cold-start wall time (imports included) and peak RSS of one loader."""
+    out = subprocess.run([sys.executable, "-c", _PROBE, loader, path],
+                         check=True, capture_output=True, text=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    from artifacts import resolve_model_checkpoint
+
+    parser = argparse.ArgumentParser(description="Convert the checkpoint for fast, mmap-based loading.")
+    parser.add_argument("--checkpoint", default="efficientnet_b3_checkpoint_fold1.pt")
+    parser.add_argument("--out", default=FAST_PATH)
+    parser.add_argument("--compare", action="store_true", help="report cold-start time and peak RSS of both paths")
+    args = parser.parse_args()
+    args.checkpoint = resolve_model_checkpoint(args.checkpoint)
+
+    convert(args.checkpoint, args.out)
+    print(f"Wrote {args.out}")
+
+    if args.compare:
+        report = {
+            "checkpoint (torch.load + load_state_dict)": measure("load_checkpoint", args.checkpoint),
+            "safetensors (mmap + meta device)": measure("load_fast", args.out),
+        }
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+## Raw EEG ingestion: vectorized STFT spectrograms straight to model tensors
+import os
+from dataclasses import dataclass
+from io import BytesIO, StringIO
+from typing import Optional, Tuple
+
+import numpy as np
+import torch
+
+from prediction import IMAGENET_MEAN, IMAGENET_STD
+
+
+@dataclass(frozen=True)
+class SpectrogramConfig:
+    """How a spectrogram image is rendered from EEG.
+
+    The training images were rendered offline and that script is not part
+    of this repo. These defaults describe the usual EEG rendering (Hann
+    STFT, power in dB up to 50 Hz, low frequencies at the bottom, viridis
+    colormap). Set them to the training render's values; `render_image`
+    lets you compare against a saved training PNG.
+    """
+    nperseg: int = 256
+    hop: int = 32
+    fmin: float = 0.5
+    fmax: float = 50.0
+    db_range: Optional[Tuple[float, float]] = None  # None: per-image min/max
+    cmap: str = "viridis"
+    channel_reduce: str = "mean"  # "mean" power across channels, or "stack" channels vertically
+    image_size: Tuple[int, int] = (224, 224)
+
+
+def load_eeg(data: bytes, filename: str) -> np.ndarray:
+    """Parse .npy or .csv EEG into a float32 (channels, samples) array.
+
+    CSV columns are channels (a leading time/timestamp column is dropped);
+    arrays are transposed when they look like (samples, channels).
+    """
+    ext = os.path.splitext(filename)[1].lower()
+    if ext == ".npy":
+        x = np.load(BytesIO(data), allow_pickle=False)
+    elif ext == ".csv":
+        import pandas as pd
+
+        df = pd.read_csv(StringIO(data.decode("utf-8")))
+        df = df.drop(columns=[c for c in df.columns if str(c).strip().lower() in ("time", "timestamp", "t")])
+        x = df.select_dtypes(include=[np.number]).to_numpy().T
+    else:
+        raise ValueError(f"Unsupported EEG file type {ext!r}; use .npy or .csv")
+
+    x = np.asarray(x, dtype=np.float32)
+    if x.ndim == 1:
+        x = x[None, :]
+    if x.ndim != 2:
+        raise ValueError(f"Expected 2-D EEG (channels x samples), got shape {x.shape}")
+    if x.shape[0] > x.shape[1]:
+        x = x.T
+    return np.ascontiguousarray(x)
+
+
+def stft_power(x: np.ndarray, nperseg: int, hop: int) -> np.ndarray:
+    """Power STFT over the last axis for any leading shape: (..., samples) -> (..., freqs, frames).
+
+    Frames are strided views (no copy) and one rfft covers every channel,
+    segment and frame at once.
+    """
+    if x.shape[-1] < nperseg:
+        raise ValueError(f"Need at least {nperseg} samples, got {x.shape[-1]}")
+    frames = np.lib.stride_tricks.sliding_window_view(x, nperseg, axis=-1)[..., ::hop, :]
+    window = np.hanning(nperseg).astype(np.float32)
+    spec = np.fft.rfft(frames * window, axis=-1)
+    power = (spec.real ** 2 + spec.imag ** 2) / (window ** 2).sum()
+    return np.swapaxes(power, -1, -2).astype(np.float32)
+
+
+def _colormap_lut(name: str) -> np.ndarray:
+    import matplotlib
+
+    return matplotlib.colormaps[name](np.linspace(0.0, 1.0, 256))[:, :3].astype(np.float32)
+
+
+def render_batch(power: np.ndarray, fs: float, cfg: SpectrogramConfig) -> np.ndarray:
+    """(channels, segments, freqs, frames) power -> (segments, H', W', 3) RGB in [0, 1]."""
+    freqs = np.fft.rfftfreq(cfg.nperseg, d=1.0 / fs)
+    band = (freqs >= cfg.fmin) & (freqs <= cfg.fmax)
+    power = power[:, :, band, :]
+
+    if cfg.channel_reduce == "mean":
+        power = power.mean(axis=0)  # (segments, freqs, frames)
+    elif cfg.channel_reduce == "stack":
+        # frequency axis runs low -> high and is flipped when rendered, so the
+        # last channel goes first to end up with channel 0 at the top
+        power = np.concatenate(list(power[::-1]), axis=1)
+    else:
+        raise ValueError(f"Unknown channel_reduce {cfg.channel_reduce!r}")
+
+    db = 10.0 * np.log10(power + 1e-12)
+    if cfg.db_range is None:
+        lo = db.min(axis=(1, 2), keepdims=True)
+        hi = db.max(axis=(1, 2), keepdims=True)
+    else:
+        lo, hi = cfg.db_range
+    scaled = np.clip((db - lo) / np.maximum(hi - lo, 1e-12), 0.0, 1.0)
+
+    # image row 0 is the top, so put the highest frequency there
+    idx = (scaled[:, ::-1, :] * 255).astype(np.uint8)
+    return _colormap_lut(cfg.cmap)[idx]
+
+
+def segment(x: np.ndarray, fs: float, segment_seconds: Optional[float]) -> np.ndarray:
+    """(channels, samples) -> (channels, segments, segment_samples); trailing remainder dropped."""
+    if not segment_seconds:
+        return x[:, None, :]
+    seg_len = int(round(segment_seconds * fs))
+    n_segments = x.shape[1] // seg_len
+    if n_segments == 0:
+        raise ValueError(f"Recording shorter than one {segment_seconds}s segment")
+    return x[:, :n_segments * seg_len].reshape(x.shape[0], n_segments, seg_len)
+
+
+def to_model_tensor(rgb: np.ndarray, image_size: Tuple[int, int]) -> torch.Tensor:
+    """(N, H, W, 3) float RGB in [0, 1] -> normalized (N, 3, *image_size) tensor, no image codec."""
+    import torch.nn.functional as F
+
+    t = torch.from_numpy(np.ascontiguousarray(rgb)).permute(0, 3, 1, 2)
+    t = F.interpolate(t, size=image_size, mode="bilinear", align_corners=False, antialias=True)
+    mean = torch.tensor(IMAGENET_MEAN).view(1, 3, 1, 1)
+    std = torch.tensor(IMAGENET_STD).view(1, 3, 1, 1)
+    return (t - mean) / std
+
+
+def eeg_to_tensors(x: np.ndarray, fs: float, cfg: SpectrogramConfig = SpectrogramConfig(),
+                   segment_seconds: Optional[float] = None) -> torch.Tensor:
+    """Raw EEG (channels, samples) -> (segments, 3, H, W) model input, ready for pred_batch."""
+    power = stft_power(segment(x, fs, segment_seconds), cfg.nperseg, cfg.hop)
+    return to_model_tensor(render_batch(power, fs, cfg), cfg.image_size)
+
+
+def render_image(x: np.ndarray, fs: float, cfg: SpectrogramConfig = SpectrogramConfig()):
+    """Render a whole recording as a PIL image, for checking against training PNGs."""
+    from PIL import Image
+
+    rgb = render_batch(stft_power(x[:, None, :], cfg.nperseg, cfg.hop), fs, cfg)[0]
+    return Image.fromarray((rgb * 255).astype(np.uint8)).resize(cfg.image_size[::-1], Image.BILINEAR)
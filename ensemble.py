@@ -0,0 +1,151 @@
+## K-fold ensemble evaluated in one vectorized forward pass
+import argparse
+import copy
+import glob
+import json
+import os
+import re
+from typing import List, Optional
+
+import numpy as np
+import torch
+
+FOLD_PATTERN = "efficientnet_b3_checkpoint_fold*.pt"
+
+
+def find_fold_checkpoints(pattern: str = FOLD_PATTERN, cache_dir: Optional[str] = None) -> List[str]:
+    """One checkpoint per fold, sorted by fold number, skipping Git LFS pointer stubs.
+
+    Matches `pattern` and also the shared artifact cache, where
+    artifacts.resolve_artifact stores downloads as "<sha256 prefix>-<name>".
+    A real file matching `pattern` wins over a cached copy of the same fold.
+    """
+    from artifacts import default_cache_dir
+
+    def fold_number(path):
+        match = re.search(r"fold(\d+)", os.path.basename(path))
+        return int(match.group(1)) if match else 0
+
+    cached = os.path.join(cache_dir or default_cache_dir(), "*-" + os.path.basename(pattern))
+    by_fold = {}
+    for path in sorted(glob.glob(pattern)) + sorted(glob.glob(cached)):
+        with open(path, "rb") as f:
+            if f.read(24).startswith(b"version https://git-lfs"):
+                continue
+        by_fold.setdefault(fold_number(path), path)
+    return [by_fold[fold] for fold in sorted(by_fold)]
+
+
+class FoldEnsemble(torch.nn.Module):
+    """K models with the same architecture, stacked and run with torch.func.vmap.
+
+    Parameters and buffers of all folds are stacked along a new leading
+    dimension and one functional forward is vmapped over it, so the K folds
+    run as one batched pass instead of K sequential ones. forward() returns
+    the log of the fold-averaged softmax, so a softmax downstream (as in
+    pred_class / pred_batch) yields exactly the averaged probabilities.
+    """
+
+    def __init__(self, models: List[torch.nn.Module]):
+        super().__init__()
+        from torch.func import stack_module_state
+
+        if not models:
+            raise ValueError("FoldEnsemble needs at least one model")
+        for m in models:
+            m.eval()
+        params, buffers = stack_module_state(models)
+        self.num_folds = len(models)
+
+        # stateless copy of the architecture; real tensors come from the stacks
+        self._base = [copy.deepcopy(models[0]).to("meta")]
+        self._param_names = list(params)
+        self._buffer_names = list(buffers)
+        # registered as buffers so .to(device) moves them with the module
+        for i, name in enumerate(self._param_names):
+            self.register_buffer(f"stacked_param_{i}", params[name].detach())
+        for i, name in enumerate(self._buffer_names):
+            self.register_buffer(f"stacked_buffer_{i}", buffers[name])
+
+    def _stacked(self):
+        params = {n: getattr(self, f"stacked_param_{i}") for i, n in enumerate(self._param_names)}
+        buffers = {n: getattr(self, f"stacked_buffer_{i}") for i, n in enumerate(self._buffer_names)}
+        return params, buffers
+
+    def fold_logits(self, x: torch.Tensor) -> torch.Tensor:
+        """Per-fold logits, shape (K, batch, num_classes)."""
+        from torch.func import functional_call, vmap
+
+        base = self._base[0]
+
+        def run(params, buffers, inputs):
+            return functional_call(base, (params, buffers), (inputs,))
+
+        params, buffers = self._stacked()
+        return vmap(run, in_dims=(0, 0, None))(params, buffers, x)
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        probs = torch.softmax(self.fold_logits(x), dim=-1).mean(dim=0)
+        return torch.log(probs.clamp_min(1e-12))
+
+
+def load_ensemble(paths: List[str], device="cpu") -> FoldEnsemble:
+    from prediction import load_checkpoint
+
+    models = [load_checkpoint(path, "cpu") for path in paths]
+    ensemble = FoldEnsemble(models)
+    del models
+    return ensemble.to(device).eval()
+
+
+def evaluate(ensemble: FoldEnsemble, data_dir: str, class_names: List[str], batch_size: int = 32) -> dict:
+    """Accuracy of each fold and of the ensemble on <data_dir>/<class name>/*.png|jpg."""
+    from PIL import Image
+    from prediction import build_transform
+
+    files, labels = [], []
+    for idx, name in enumerate(class_names):
+        for path in sorted(glob.glob(os.path.join(data_dir, name, "*"))):
+            if path.lower().endswith((".jpg", ".jpeg", ".png")):
+                files.append(path)
+                labels.append(idx)
+    if not files:
+        raise FileNotFoundError(f"No labelled images under {data_dir}/<class name>/")
+
+    transform = build_transform()
+    device = next(ensemble.buffers()).device
+    fold_preds, ens_preds = [], []
+    with torch.inference_mode():
+        for start in range(0, len(files), batch_size):
+            batch = torch.stack([transform(Image.open(f).convert("RGB"))
+                                 for f in files[start:start + batch_size]]).to(device)
+            logits = ensemble.fold_logits(batch)
+            fold_preds.append(logits.argmax(-1).cpu().numpy())
+            ens_preds.append(torch.softmax(logits, -1).mean(0).argmax(-1).cpu().numpy())
+
+    labels = np.asarray(labels)
+    fold_preds = np.concatenate(fold_preds, axis=1)
+    ens_preds = np.concatenate(ens_preds)
+    return {
+        "images": len(files),
+        "fold_accuracy": [float((p == labels).mean()) for p in fold_preds],
+        "ensemble_accuracy": float((ens_preds == labels).mean()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate the k-fold ensemble against single folds.")
+    parser.add_argument("--pattern", default=FOLD_PATTERN)
+    parser.add_argument("--data", required=True, help="directory with one sub-directory per class")
+    args = parser.parse_args()
+
+    paths = find_fold_checkpoints(args.pattern)
+    if not paths:
+        raise SystemExit(f"No fold checkpoints match {args.pattern}")
+    report = evaluate(load_ensemble(paths), args.data, ["Fear", "Happy", "Neutral", "Sad"])
+    report["checkpoints"] = paths
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
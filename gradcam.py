@@ -0,0 +1,140 @@
+## Grad-CAM heatmaps for every class from one forward pass
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import numpy as np
+import torch
+
+
+def find_target_layer(model: torch.nn.Module) -> torch.nn.Module:
+    """Last conv stage: timm EfficientNet's conv_head + bn2 (+ act), else the last Conv2d."""
+    bn2 = getattr(model, "bn2", None)
+    if isinstance(bn2, torch.nn.Module) and not isinstance(bn2, torch.nn.Identity):
+        return bn2
+    convs = [m for m in model.modules() if isinstance(m, torch.nn.Conv2d)]
+    if not convs:
+        raise ValueError("Model has no Conv2d layer to explain")
+    return convs[-1]
+
+
+class GradCAM:
+    """Grad-CAM for all classes at once, hooked on the last conv stage at construction.
+
+    One forward pass captures the stage's activations A; one batched
+    backward (autograd.grad with is_grads_batched) gives dlogit_c/dA for
+    every class c together. Parameters are frozen and the captured A is
+    re-rooted as a leaf, so autograd only records the pooling + classifier
+    after it: the cost is about one extra forward pass, whatever the number
+    of classes. Results are cached by content key.
+
+    The hook only acts on the thread that is currently explaining, so the
+    same model keeps serving ordinary predictions from other threads.
+    """
+
+    def __init__(self, model: torch.nn.Module, target_layer: Optional[torch.nn.Module] = None,
+                 cache_size: int = 64):
+        self.model = model
+        # precision.CpuPrecisionModel wraps the timm model as .model
+        inner = getattr(model, "model", model)
+        self.target_layer = target_layer if target_layer is not None else find_target_layer(inner)
+        for p in model.parameters():
+            p.requires_grad_(False)
+
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, Tuple[np.ndarray, np.ndarray]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._owner = None
+        self._activation = None
+        self._handle = self.target_layer.register_forward_hook(self._hook)
+
+    def _hook(self, module, inputs, output):
+        if self._owner != threading.get_ident():
+            return None
+        # a leaf that requires grad: the graph starts here instead of at the input
+        self._activation = output.detach().requires_grad_(True)
+        return self._activation
+
+    def _class_grads(self, logits: torch.Tensor, activation: torch.Tensor) -> torch.Tensor:
+        """d logit_c / dA for every class c, shape (n_classes, *A.shape)."""
+        n_classes = logits.shape[1]
+        one_hot = torch.eye(n_classes, dtype=logits.dtype, device=logits.device).unsqueeze(1)
+        try:
+            (grads,) = torch.autograd.grad(logits, activation, grad_outputs=one_hot, is_grads_batched=True)
+        except RuntimeError:
+            # some ops have no batching rule for the vmapped backward; fall back to one pass per class
+            grads = torch.stack([torch.autograd.grad(logits, activation, grad_outputs=g,
+                                                     retain_graph=i < n_classes - 1)[0]
+                                 for i, g in enumerate(one_hot)])
+        return grads
+
+    def explain(self, x: torch.Tensor, key: Optional[str] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """(cams, probs) for one preprocessed CHW tensor.
+
+        cams is (n_classes, h, w) float32 in [0, 1] at the target layer's
+        resolution (7x7 for a 224 input); upsample with `overlay`. probs are
+        the softmax of the same forward pass.
+        """
+        with self._lock:
+            if key is not None and key in self._cache:
+                self._cache.move_to_end(key)
+                cams, probs = self._cache[key]
+                return cams.astype(np.float32), probs
+
+        device = next(self.model.parameters()).device
+        with self._lock:
+            self._owner = threading.get_ident()
+            try:
+                with torch.enable_grad():
+                    logits = self.model(x.unsqueeze(0).float().to(device)).float()
+                    activation = self._activation
+                    if activation is None:
+                        raise RuntimeError("Target layer was not reached in the forward pass")
+                    grads = self._class_grads(logits, activation)
+            finally:
+                self._owner = None
+                self._activation = None
+
+        with torch.no_grad():
+            a = activation[0].float()                                # (C, h, w)
+            weights = grads[:, 0].float().mean(dim=(2, 3))           # (n_classes, C)
+            cams = torch.relu(torch.einsum("kc,chw->khw", weights, a))
+            peak = cams.amax(dim=(1, 2), keepdim=True)
+            cams = (cams / peak.clamp_min(1e-8)).cpu().numpy()
+            probs = torch.softmax(logits, dim=1)[0].cpu().numpy()
+
+        if key is not None:
+            with self._lock:
+                # float16 keeps each entry to a few hundred bytes
+                self._cache[key] = (cams.astype(np.float16), probs)
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return cams, probs
+
+    def remove(self):
+        self._handle.remove()
+
+
+def build_gradcam(model) -> Optional[GradCAM]:
+    """GradCAM for an eager torch model, or None for backends without autograd (ONNX, int8, ensembles)."""
+    if not isinstance(model, torch.nn.Module) or isinstance(model, torch.jit.ScriptModule):
+        return None
+    if getattr(model, "num_folds", 1) > 1:
+        # folds run through vmap over stacked weights; module hooks never see them
+        return None
+    try:
+        return GradCAM(model)
+    except ValueError:
+        return None
+
+
+def overlay(image, cam: np.ndarray, alpha: float = 0.45, cmap: str = "jet"):
+    """Blend one (h, w) map in [0, 1] over a PIL image, upsampled to the image size."""
+    import matplotlib
+    from PIL import Image
+
+    image = image.convert("RGB")
+    heat = Image.fromarray(cam.astype(np.float32)).resize(image.size, Image.BILINEAR)
+    idx = (np.clip(np.asarray(heat), 0.0, 1.0) * 255).astype(np.uint8)
+    lut = (matplotlib.colormaps[cmap](np.linspace(0.0, 1.0, 256))[:, :3] * 255).astype(np.uint8)
+    return Image.blend(image, Image.fromarray(lut[idx]), alpha)
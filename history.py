@@ -0,0 +1,129 @@
+## Per-session prediction history in fixed-size arrays with incremental aggregates
+import time
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+SOURCES = ("single", "tta", "bulk")
+
+
+class PredictionHistory:
+    """The last `capacity` predictions of one session, in preallocated arrays.
+
+    Probabilities live in a (capacity, n_classes) float16 matrix, and file
+    name, time, source and predicted class in parallel arrays. It is a ring
+    buffer: once full, new rows overwrite the oldest, so memory per session
+    is fixed. Class counts, the confidence histogram and the probability sums
+    are updated as rows are added and evicted, never recomputed from scratch.
+    """
+
+    def __init__(self, class_names: Sequence[str], capacity: int = 500, confidence_bins: int = 10):
+        if capacity < 1:
+            raise ValueError("capacity must be >= 1")
+        self.class_names = list(class_names)
+        self.capacity = capacity
+        n_classes = len(self.class_names)
+
+        self.probs = np.zeros((capacity, n_classes), dtype=np.float16)
+        self.predicted = np.zeros(capacity, dtype=np.int8)
+        self.timestamps = np.zeros(capacity, dtype=np.float64)
+        self.sources = np.zeros(capacity, dtype=np.int8)
+        self.names = np.empty(capacity, dtype=object)
+
+        self.bin_edges = np.linspace(0.0, 1.0, confidence_bins + 1)
+        self._class_counts = np.zeros(n_classes, dtype=np.int64)
+        self._confidence_counts = np.zeros(confidence_bins, dtype=np.int64)
+        self._prob_sums = np.zeros(n_classes, dtype=np.float64)
+        self._next = 0  # slot the next row goes into
+        self._size = 0
+        self._total = 0  # rows ever added, including evicted ones
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def total_added(self) -> int:
+        return self._total
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held by the arrays (file name strings not included)."""
+        return sum(a.nbytes for a in (self.probs, self.predicted, self.timestamps, self.sources, self.names))
+
+    def _confidence_bin(self, confidence: np.ndarray) -> np.ndarray:
+        return np.clip((confidence * (len(self.bin_edges) - 1)).astype(np.int64), 0, len(self.bin_edges) - 2)
+
+    def _update_aggregates(self, probs: np.ndarray, predicted: np.ndarray, sign: int):
+        n_classes, n_bins = len(self.class_names), len(self.bin_edges) - 1
+        confidence = probs[np.arange(len(probs)), predicted].astype(np.float32)
+        self._class_counts += sign * np.bincount(predicted, minlength=n_classes)
+        self._confidence_counts += sign * np.bincount(self._confidence_bin(confidence), minlength=n_bins)
+        self._prob_sums += sign * probs.sum(axis=0, dtype=np.float64)
+
+    def add(self, probs: np.ndarray, name: str, source: str = "single", timestamp: Optional[float] = None):
+        """Append one (n_classes,) probability row."""
+        self.add_batch(np.asarray(probs)[None, :], [name], source, timestamp)
+
+    def add_batch(self, probs: np.ndarray, names: List[str], source: str = "bulk",
+                  timestamp: Optional[float] = None):
+        """Append (n, n_classes) rows in one vectorized write, evicting the oldest if full."""
+        probs = np.asarray(probs)
+        if probs.ndim != 2 or probs.shape[1] != len(self.class_names):
+            raise ValueError(f"Expected (n, {len(self.class_names)}) probabilities, got {probs.shape}")
+        if len(names) != len(probs):
+            raise ValueError("names and probs must have the same length")
+        self._total += len(probs)
+        # only the last `capacity` rows of a large batch can survive
+        probs, names = probs[-self.capacity:], list(names)[-self.capacity:]
+        n = len(probs)
+        if n == 0:
+            return
+
+        # aggregates come from the stored float16 values so eviction subtracts exactly what was added
+        stored = probs.astype(np.float16)
+        predicted = stored.argmax(axis=1).astype(np.int8)
+        slots = (self._next + np.arange(n)) % self.capacity
+
+        # slots still holding a row are evicted (always the oldest ones)
+        old = slots[(slots - (self._next - self._size)) % self.capacity < self._size]
+        if len(old):
+            self._update_aggregates(self.probs[old], self.predicted[old].astype(np.int64), -1)
+
+        self.probs[slots] = stored
+        self.predicted[slots] = predicted
+        self.timestamps[slots] = time.time() if timestamp is None else timestamp
+        self.sources[slots] = SOURCES.index(source)
+        self.names[slots] = names
+        self._update_aggregates(stored, predicted.astype(np.int64), +1)
+
+        self._next = int((self._next + n) % self.capacity)
+        self._size = min(self.capacity, self._size + n)
+
+    def order(self) -> np.ndarray:
+        """Slot indices from oldest to newest."""
+        start = self._next - self._size
+        return (start + np.arange(self._size)) % self.capacity
+
+    def class_counts(self) -> np.ndarray:
+        return self._class_counts.copy()
+
+    def confidence_histogram(self):
+        """(bin edges, counts) of the predicted class's probability."""
+        return self.bin_edges, self._confidence_counts.copy()
+
+    def mean_probs(self) -> np.ndarray:
+        if not self._size:
+            return np.zeros(len(self.class_names))
+        return self._prob_sums / self._size
+
+    def recent(self, n: int = 10) -> dict:
+        """Columns of the last n rows, newest first."""
+        idx = self.order()[::-1][:n]
+        predicted = self.predicted[idx]
+        return {
+            "time": self.timestamps[idx],
+            "file": self.names[idx],
+            "source": np.asarray(SOURCES)[self.sources[idx]],
+            "predicted_class": np.asarray(self.class_names)[predicted],
+            "confidence": self.probs[idx, predicted].astype(np.float32),
+        }
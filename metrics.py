@@ -0,0 +1,123 @@
+## Per-stage latency instrumentation with rolling percentiles and Prometheus export
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+# Prometheus histogram bucket upper bounds, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class StageHistogram:
+    """Cumulative bucket counts for Prometheus plus a window of recent samples for percentiles."""
+
+    def __init__(self, window: int = 1000):
+        self.recent = deque(maxlen=window)
+        self.bucket_counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds: float):
+        self.recent.append(seconds)
+        self.count += 1
+        self.total += seconds
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.bucket_counts[i] += 1
+                break
+
+    def percentiles(self) -> dict:
+        samples = sorted(self.recent)
+        if not samples:
+            return {"count": self.count}
+
+        def pct(p):
+            return samples[min(len(samples) - 1, int(p / 100 * len(samples)))] * 1000
+
+        return {"count": self.count, "p50_ms": pct(50), "p90_ms": pct(90), "p99_ms": pct(99),
+                "max_ms": samples[-1] * 1000}
+
+
+class MetricsRegistry:
+    """Thread-safe stage timings shared by every session/request in the process."""
+
+    def __init__(self, window: int = 1000):
+        self.window = window
+        self._stages: Dict[str, StageHistogram] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, seconds: float):
+        with self._lock:
+            hist = self._stages.get(stage)
+            if hist is None:
+                hist = self._stages[stage] = StageHistogram(self.window)
+            hist.observe(seconds)
+
+    @contextmanager
+    def timed(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def snapshot(self) -> Dict[str, dict]:
+        """Rolling percentiles per stage (milliseconds)."""
+        with self._lock:
+            return {stage: hist.percentiles() for stage, hist in sorted(self._stages.items())}
+
+    def prometheus_text(self, name: str = "emotion_stage_seconds",
+                        labels: Optional[Dict[str, str]] = None) -> str:
+        """Prometheus text exposition format (a histogram labelled by stage).
+
+        `labels` are added to every series, e.g. {"worker": "0", "pid": "123"}
+        so each process of a pre-fork server reports its own series.
+        """
+        extra = "".join(f',{key}="{value}"' for key, value in (labels or {}).items())
+        lines = [f"# HELP {name} Latency of each upload/predict/render stage.",
+                 f"# TYPE {name} histogram"]
+        with self._lock:
+            for stage, hist in sorted(self._stages.items()):
+                cumulative = 0
+                for bound, count in zip(BUCKETS, hist.bucket_counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{stage="{stage}"{extra},le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{stage="{stage}"{extra},le="+Inf"}} {hist.count}')
+                lines.append(f'{name}_sum{{stage="{stage}"{extra}}} {hist.total}')
+                lines.append(f'{name}_count{{stage="{stage}"{extra}}} {hist.count}')
+        return "\n".join(lines) + "\n"
+
+
+# Process-wide registry used by prediction.py, app.py and server.py
+METRICS = MetricsRegistry()
+timed = METRICS.timed
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    labels: Optional[Dict[str, str]] = None
+
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = METRICS.prometheus_text(labels=self.labels).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_exporter(port: int, host: str = "0.0.0.0",
+                   labels: Optional[Dict[str, str]] = None) -> ThreadingHTTPServer:
+    """Serve /metrics on a background thread (for processes without their own HTTP server)."""
+    handler = type("MetricsHandler", (_MetricsHandler,), {"labels": labels})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-exporter", daemon=True).start()
+    return server
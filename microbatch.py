@@ -0,0 +1,111 @@
+## Dynamic micro-batching in front of a shared model
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+from typing import Optional
+
+import numpy as np
+import torch
+
+
+class MicroBatcher:
+    """Collects single-image requests from any thread into batched forward passes.
+
+    One worker thread takes the first queued request, then keeps collecting
+    until it has `max_batch_size` requests or `max_wait_ms` has passed since
+    the first one arrived. It runs one forward pass and hands each caller its
+    row of softmax probabilities.
+    """
+
+    def __init__(self, model, device=None, max_batch_size: int = 16, max_wait_ms: float = 5.0):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be >= 1")
+        self.model = model
+        self.device = device if device is not None else torch.device("cpu")
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+
+        self._queue: "queue.Queue[tuple]" = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._batch_sizes: Counter = Counter()
+        self._queue_depths: Counter = Counter()
+        self._requests = 0
+        self._stopped = threading.Event()
+        self._worker = threading.Thread(target=self._run, name="microbatch-worker", daemon=True)
+        self._worker.start()
+
+    def submit(self, tensor: torch.Tensor) -> Future:
+        """Queue one preprocessed CHW tensor; the Future resolves to a (n_classes,) array."""
+        if self._stopped.is_set():
+            raise RuntimeError("MicroBatcher is shut down")
+        future: Future = Future()
+        self._queue.put((tensor, future))
+        return future
+
+    def predict(self, tensor: torch.Tensor, timeout: Optional[float] = None) -> np.ndarray:
+        return self.submit(tensor).result(timeout=timeout)
+
+    def _collect(self, first) -> list:
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        # runs until the shutdown sentinel, so requests queued before shutdown still complete
+        while True:
+            first = self._queue.get()
+            if first is None:
+                break
+            depth = self._queue.qsize() + 1
+            batch = self._collect(first)
+            # a shutdown sentinel picked up while collecting ends the loop after this batch
+            stop = any(item is None for item in batch)
+            batch = [item for item in batch if item is not None]
+
+            with self._stats_lock:
+                self._batch_sizes[len(batch)] += 1
+                self._queue_depths[depth] += 1
+                self._requests += len(batch)
+
+            tensors, futures = zip(*batch)
+            try:
+                with torch.inference_mode():
+                    inputs = torch.stack(tensors).to(self.device)
+                    probs = torch.softmax(self.model(inputs), dim=1).float().cpu().numpy()
+                for future, row in zip(futures, probs):
+                    future.set_result(row)
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+            if stop:
+                break
+
+    def stats(self) -> dict:
+        """Request count, current queue depth and batch-size / queue-depth histograms."""
+        with self._stats_lock:
+            batches = sum(self._batch_sizes.values())
+            return {
+                "requests": self._requests,
+                "batches": batches,
+                "mean_batch_size": self._requests / batches if batches else 0.0,
+                "queue_depth": self._queue.qsize(),
+                "batch_size_histogram": dict(sorted(self._batch_sizes.items())),
+                "queue_depth_histogram": dict(sorted(self._queue_depths.items())),
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait_ms,
+            }
+
+    def shutdown(self, timeout: Optional[float] = None):
+        self._stopped.set()
+        self._queue.put(None)
+        self._worker.join(timeout)
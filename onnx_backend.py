@@ -0,0 +1,104 @@
+## ONNX export and ONNX Runtime CPU backend
+import argparse
+import copy
+import json
+from typing import List, Tuple
+
+import numpy as np
+import torch
+
+from prediction import pred_batch
+
+
+def export_onnx(model: torch.nn.Module, onnx_path: str, image_size: Tuple[int, int] = (224, 224),
+                opset: int = 17) -> str:
+    """Write `model` to ONNX with a dynamic batch dimension.
+
+    Exports a CPU copy, so a model that is being served on CUDA stays where it is.
+    """
+    if getattr(model, "num_folds", 1) > 1:
+        # the fold ensemble runs its folds through torch.func.vmap, which the exporter cannot trace
+        raise ValueError("Fold ensembles cannot be exported to ONNX; export a single fold checkpoint")
+    model = copy.deepcopy(model).cpu().eval()
+    dummy = torch.randn(1, 3, *image_size)
+    torch.onnx.export(
+        model,
+        dummy,
+        onnx_path,
+        input_names=["input"],
+        output_names=["logits"],
+        dynamic_axes={"input": {0: "batch"}, "logits": {0: "batch"}},
+        opset_version=opset,
+        do_constant_folding=True,
+    )
+    return onnx_path
+
+
+class OnnxModel:
+    """ONNX Runtime session that can stand in for the torch model.
+
+    Takes and returns torch tensors, and `to()` / `eval()` are no-ops, so
+    `pred_class` and `pred_batch` work with it unchanged.
+    """
+
+    def __init__(self, onnx_path: str, intra_op_threads: int = 0, inter_op_threads: int = 0):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = inter_op_threads
+        self.onnx_path = onnx_path
+        self.session = ort.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        inputs = x.detach().cpu().numpy().astype(np.float32, copy=False)
+        (logits,) = self.session.run(None, {self.input_name: inputs})
+        return torch.from_numpy(logits)
+
+    def to(self, *args, **kwargs):
+        return self
+
+    def eval(self):
+        return self
+
+
+def check_parity(model: torch.nn.Module, onnx_model: OnnxModel, images: List, class_names: List[str],
+                 atol: float = 1e-4) -> dict:
+    """Compare eager and ONNX Runtime probabilities on the same images."""
+    eager = pred_batch(model, images, class_names, device=torch.device("cpu"))
+    ort_probs = pred_batch(onnx_model, images, class_names, device=torch.device("cpu"))
+    diff = np.abs(eager - ort_probs)
+    return {
+        "images": len(eager),
+        "max_abs_diff": float(diff.max()) if diff.size else 0.0,
+        "mean_abs_diff": float(diff.mean()) if diff.size else 0.0,
+        "argmax_agreement": float((eager.argmax(1) == ort_probs.argmax(1)).mean()) if diff.size else 1.0,
+        "passed": bool(diff.size == 0 or diff.max() <= atol),
+    }
+
+
+def main():
+    from artifacts import resolve_model_checkpoint
+    from fixtures import load_fixture_images
+    from prediction import load_checkpoint
+
+    parser = argparse.ArgumentParser(description="Export the checkpoint to ONNX and check parity.")
+    parser.add_argument("--checkpoint", default="efficientnet_b3_checkpoint_fold1.pt")
+    parser.add_argument("--out", default="efficientnet_b3_fold1.onnx")
+    parser.add_argument("--fixtures", default=None, help="directory or glob of images (default: synthetic)")
+    parser.add_argument("--atol", type=float, default=1e-4)
+    args = parser.parse_args()
+
+    class_names = ["Fear", "Happy", "Neutral", "Sad"]
+    model = load_checkpoint(resolve_model_checkpoint(args.checkpoint), "cpu")
+    export_onnx(model, args.out)
+    report = check_parity(model, OnnxModel(args.out), load_fixture_images(args.fixtures),
+                          class_names, atol=args.atol)
+    print(json.dumps(report, indent=2))
+    raise SystemExit(0 if report["passed"] else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+## Channels-last memory format and bfloat16 autocast for CPU inference
+import argparse
+import itertools
+import json
+import time
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+import numpy as np
+import torch
+
+from prediction import build_transform, pred_batch
+
+PRECISIONS = ("fp32", "bf16")
+REPORT_PATH = "precision_report.json"
+
+# CPU flags that mean bf16 matmul/conv run natively rather than emulated in fp32
+_NATIVE_BF16_FLAGS = {"avx512_bf16", "amx_bf16", "bf16"}  # "bf16" is the aarch64 name
+
+
+def _cpu_flags() -> Optional[set]:
+    """CPU feature flags from /proc/cpuinfo, or None where that file does not exist."""
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith(("flags", "Features")):
+                    return set(line.split(":", 1)[1].split())
+    except OSError:
+        pass
+    return None
+
+
+@lru_cache(maxsize=None)
+def bf16_supported() -> bool:
+    """True when oneDNN can run bf16 on this CPU and the CPU has native bf16 instructions.
+
+    Without AVX512-BF16/AMX (or the Arm BF16 extension) oneDNN emulates bf16,
+    which is slower than plain fp32, so that case counts as unsupported.
+    """
+    if not torch.backends.mkldnn.is_available():
+        return False
+    flags = _cpu_flags()
+    if flags is not None:
+        if not flags & _NATIVE_BF16_FLAGS:
+            return False
+    else:
+        check = getattr(torch.ops.mkldnn, "_is_mkldnn_bf16_supported", None)
+        if check is None or not check():
+            return False
+    # last check: a tiny conv under autocast must actually run
+    try:
+        with torch.inference_mode(), torch.autocast("cpu", dtype=torch.bfloat16):
+            torch.nn.functional.conv2d(torch.randn(1, 3, 8, 8), torch.randn(4, 3, 3, 3))
+    except RuntimeError:
+        return False
+    return True
+
+
+def resolve_precision(requested: str, device) -> Tuple[str, Optional[str]]:
+    """(precision to use, reason for falling back or None)."""
+    if requested not in PRECISIONS:
+        raise ValueError(f"Unknown precision {requested!r}; expected one of {PRECISIONS}")
+    if requested == "bf16":
+        if torch.device(device).type != "cpu":
+            return "fp32", "bf16 autocast is only used for CPU inference"
+        if not bf16_supported():
+            return "fp32", "this CPU has no native bf16 support"
+    return requested, None
+
+
+def to_channels_last(model: torch.nn.Module) -> torch.nn.Module:
+    """Convert every 4-D parameter/buffer (conv weights) to channels-last in place.
+
+    Done tensor by tensor rather than with model.to(memory_format=...), which
+    rejects the 5-D stacked weights of a FoldEnsemble.
+    """
+    for t in itertools.chain(model.parameters(), model.buffers()):
+        if t.dim() == 4:
+            t.data = t.data.contiguous(memory_format=torch.channels_last)
+    return model
+
+
+class CpuPrecisionModel(torch.nn.Module):
+    """Drop-in wrapper: NHWC inputs and optional bf16 autocast, fp32 logits out.
+
+    pred_class, pred_batch, TTA and the micro-batcher keep passing ordinary
+    NCHW fp32 tensors; the conversion happens here, once per forward.
+    """
+
+    def __init__(self, model: torch.nn.Module, precision: str = "fp32", channels_last: bool = True):
+        super().__init__()
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown precision {precision!r}; expected one of {PRECISIONS}")
+        self.model = to_channels_last(model) if channels_last else model
+        self.precision = precision
+        self.channels_last = channels_last
+        self.num_folds = getattr(model, "num_folds", 1)
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        if self.channels_last and x.dim() == 4:
+            x = x.contiguous(memory_format=torch.channels_last)
+        if self.precision == "bf16":
+            with torch.autocast("cpu", dtype=torch.bfloat16):
+                return self.model(x).float()
+        return self.model(x)
+
+
+def optimize_model(model: torch.nn.Module, precision: str = "fp32", channels_last: bool = True,
+                   device="cpu") -> Tuple[torch.nn.Module, str, Optional[str]]:
+    """Wrap `model` for the requested mode; returns (model, precision used, fallback reason)."""
+    used, reason = resolve_precision(precision, device)
+    if used == "fp32" and not channels_last:
+        return model, used, reason
+    return CpuPrecisionModel(model, used, channels_last).eval(), used, reason
+
+
+def _latency_ms(model: torch.nn.Module, x: torch.Tensor, runs: int, warmup: int = 5) -> dict:
+    timings = []
+    with torch.inference_mode():
+        for i in range(warmup + runs):
+            start = time.perf_counter()
+            model(x)
+            if i >= warmup:
+                timings.append((time.perf_counter() - start) * 1000)
+    return {"p50": float(np.percentile(timings, 50)), "p99": float(np.percentile(timings, 99))}
+
+
+def drift_report(model: torch.nn.Module, images: List, class_names: List[str],
+                 runs: int = 30, batch_size: int = 16) -> dict:
+    """Latency and probability drift of each mode against plain NCHW fp32.
+
+    `model` must be an unwrapped fp32 model; the channels-last modes convert
+    its weights in place, so the fp32 reference is scored first.
+    """
+    cpu = torch.device("cpu")
+    x1 = build_transform()(images[0]).unsqueeze(0)
+    xb = torch.stack([build_transform()(img) for img in images[:batch_size]])
+
+    # built lazily and in order: the fp32 reference must run before any in-place conversion
+    modes = [("fp32", lambda: model),
+             ("fp32+channels_last", lambda: CpuPrecisionModel(model, "fp32").eval())]
+    if bf16_supported():
+        modes.append(("bf16+channels_last", lambda: CpuPrecisionModel(model, "bf16").eval()))
+
+    report = {"images": len(images), "bf16_supported": bf16_supported(), "modes": {}}
+    reference = None
+    for name, build in modes:
+        candidate = build()
+        probs = pred_batch(candidate, images, class_names, device=cpu)
+        if reference is None:
+            reference = probs
+        report["modes"][name] = {
+            "batch1_ms": _latency_ms(candidate, x1, runs),
+            f"batch{len(xb)}_ms": _latency_ms(candidate, xb, runs),
+            "top1_agreement": float((probs.argmax(1) == reference.argmax(1)).mean()),
+            "max_prob_abs_diff": float(np.abs(probs - reference).max()),
+            "mean_prob_abs_diff": float(np.abs(probs - reference).mean()),
+        }
+    return report
+
+
+def main():
+    from artifacts import resolve_model_checkpoint
+    from fixtures import load_fixture_images
+    from prediction import load_checkpoint
+
+    parser = argparse.ArgumentParser(description="Report latency and probability drift of channels-last/bf16 vs fp32.")
+    parser.add_argument("--checkpoint", default="efficientnet_b3_checkpoint_fold1.pt")
+    parser.add_argument("--fixtures", default=None, help="directory or glob of images (default: synthetic)")
+    parser.add_argument("--num-images", type=int, default=64)
+    parser.add_argument("--runs", type=int, default=30)
+    parser.add_argument("--report", default=REPORT_PATH)
+    args = parser.parse_args()
+
+    class_names = ["Fear", "Happy", "Neutral", "Sad"]
+    model = load_checkpoint(resolve_model_checkpoint(args.checkpoint), "cpu")
+    report = drift_report(model, load_fixture_images(args.fixtures, n=args.num_images), class_names,
+                          runs=args.runs)
+    with open(args.report, "w") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,51 +1,373 @@
 ## Making Pridcition return class & prob
-from typing import List, Tuple
+import os
+from collections import OrderedDict
+from functools import lru_cache
+from io import BytesIO
+from itertools import islice
+from typing import Iterable, Iterator, List, Optional, Tuple
+import numpy as np
 import torch
-import torchvision.transforms as T
 from PIL import Image
 
+from metrics import timed
+
+def read_state_dict(model_path: str) -> "OrderedDict[str, torch.Tensor]":
+    """Unpickle a Lightning/Fabric checkpoint and return the timm-keyed state_dict."""
+    import lightning.fabric.wrappers
+    from torch.serialization import safe_globals
+
+    # 1. Load checkpoint, allowing the Fabric wrapper class
+    with safe_globals([lightning.fabric.wrappers._FabricModule]):
+        ckpt = torch.load(model_path, map_location="cpu", weights_only=False)
+
+    # 2. Get state_dict (dict checkpoint or pickled module)
+    if isinstance(ckpt, dict) and "state_dict" in ckpt:
+        state_dict = ckpt["state_dict"]
+    elif hasattr(ckpt, "state_dict"):
+        state_dict = ckpt.state_dict()
+    else:
+        raise ValueError(f"Checkpoint format not supported: {type(ckpt).__name__}")
+
+    # 3. Strip the 'model.' prefix Lightning adds
+    new_state_dict = OrderedDict()
+    for k, v in state_dict.items():
+        new_state_dict[k.replace("model.", "")] = v
+    return new_state_dict
+
+
+def load_checkpoint(model_path: str, device="cpu", num_classes: int = 4) -> torch.nn.Module:
+    """Build the timm EfficientNet-B3 and load weights from a Lightning/Fabric checkpoint.
+
+    Headless counterpart of `app.load_model`: raises instead of reporting
+    through Streamlit, and does not download anything.
+    """
+    import timm
+
+    new_state_dict = read_state_dict(model_path)
+    model = timm.create_model('efficientnet_b3', pretrained=False, num_classes=num_classes)
+    model.load_state_dict(new_state_dict, strict=False)
+    model.to(device)
+    model.eval()
+    return model
+
+
+def load_fast(weights_path: str, device="cpu", num_classes: int = 4) -> torch.nn.Module:
+    """Load weights written by convert_checkpoint.py.
+
+    The safetensors file is memory-mapped and the model is built on the meta
+    device, so there is no random init and no intermediate copies: the mapped
+    tensors are assigned to the module directly.
+    """
+    import timm
+    from safetensors.torch import load_file
+
+    with torch.device("meta"):
+        model = timm.create_model('efficientnet_b3', pretrained=False, num_classes=num_classes)
+    state_dict = load_file(weights_path, device="cpu")
+    model.load_state_dict(state_dict, strict=False, assign=True)
+
+    missing = [name for name, t in list(model.named_parameters()) + list(model.named_buffers()) if t.is_meta]
+    if missing:
+        raise ValueError(f"{weights_path} is missing {len(missing)} tensors, e.g. {missing[:3]}")
+    model.to(device)
+    model.eval()
+    return model
+
+
+def load_model_headless(model_path: str, fast_path: Optional[str] = None, device="cpu") -> torch.nn.Module:
+    """Same model as the app: safetensors fast path if present, else the (fetched if needed) checkpoint."""
+    if fast_path and os.path.exists(fast_path):
+        return load_fast(fast_path, device)
+    from artifacts import resolve_model_checkpoint
+
+    return load_checkpoint(resolve_model_checkpoint(model_path), device)
+
+
 def pred_class(model: torch.nn.Module, image, class_names: List[str],image_size: Tuple[int, int] = (224, 224), ):
-    
-    # 2. Open image
-    img = image
+    """(class name, probability) for one image; one-off use of `Predictor`.
+
+    Builds a Predictor per call. Anything scoring more than once should keep
+    a Predictor instead.
+    """
+    classname, probability, _ = Predictor(model, class_names, image_size=image_size, buffer_sizes=()).predict(image)
+    return classname, probability
+
+
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+# Documented agreement between preprocess_cv2 and build_transform, in
+# normalized units (1 uint8 level is ~0.017). The two backends use different
+# antialiasing kernels, so outputs are close but not bit-identical;
+# check_cv2_parity() measures this on real inputs.
+CV2_MEAN_ABS_TOLERANCE = 0.02
+CV2_MAX_ABS_TOLERANCE = 0.25
+
 
-    # 3. Create transformation for image (if one doesn't exist)
-    image_transform = T.Compose([
+@lru_cache(maxsize=8)
+def build_transform(image_size: Tuple[int, int] = (224, 224)):
+    """Same preprocessing as `pred_class`: resize, to tensor, ImageNet normalize.
+
+    Cached per image size so the Compose is built once per process.
+    """
+    import torchvision.transforms as T
+
+    return T.Compose([
             T.Resize(image_size),
             T.ToTensor(),
-            T.Normalize(mean=[0.485, 0.456, 0.406],
-                        std=[0.229, 0.224, 0.225]),
+            T.Normalize(mean=IMAGENET_MEAN,
+                        std=IMAGENET_STD),
         ])
-    
-    ### Predict on image ### 
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
-    # 4. Make sure the model is on the target device
-    model.to(device)
-    
-    # 5. Turn on model evaluation mode and inference mode
-    model.eval()
-    with torch.inference_mode():
-      # 6. Transform and add an extra dimension to image (model requires samples in [batch_size, color_channels, height, width])
-      #transformed_image = image_transform(image).unsqueeze(dim=0).float()
-      #transformed_image = image_transform(image).unsqueeze(0).float().to(device)
-      transformed_image = image_transform(image).unsqueeze(0).to(device)
-      # 7. Make a prediction on image with an extra dimension and send it to the target device
-      #target_image_pred = model(transformed_image.to(device))
-      output = model(transformed_image)
-      probs = torch.softmax(output, dim=1)
-      label_idx = torch.argmax(probs, dim=1).item()  # convert tensor to int
-    # 8. Convert logits -> prediction probabilities (using torch.softmax() for multi-class classification)
-    #target_image_pred_probs = torch.softmax(target_image_pred, dim=1)
-    
-    # 9. Convert prediction probabilities -> prediction labels
-    #target_image_pred_label = torch.argmax(target_image_pred_probs, dim=1)
-    classname = class_names[label_idx]
-    #probability = float(probs.item())  # ✅ แปลงให้เป็น float
-    probability = probs[0, label_idx].item()  # probability of predicted class
-    
-    return classname, probability
-    #classname =  class_names[target_image_pred_label]
-    #prob = target_image_pred_probs.cpu().numpy()
 
-    #return prob
\ No newline at end of file
+# (x / 255 - mean) / std folded into one multiply-add per channel
+_NORM_SCALE = torch.tensor([1.0 / (255.0 * s) for s in IMAGENET_STD]).view(3, 1, 1)
+_NORM_BIAS = torch.tensor([-m / s for m, s in zip(IMAGENET_MEAN, IMAGENET_STD)]).view(3, 1, 1)
+
+
+def _jpeg_reduction(image_bytes: bytes, image_size: Tuple[int, int]) -> int:
+    """Largest JPEG DCT scale factor (1, 2, 4, 8) that keeps the decode >= 2x the target."""
+    if image_bytes[:2] != b"\xff\xd8":
+        return 1
+    try:
+        width, height = Image.open(BytesIO(image_bytes)).size  # header only
+    except Exception:
+        return 1
+    for factor in (8, 4, 2):
+        if width // factor >= 2 * image_size[1] and height // factor >= 2 * image_size[0]:
+            return factor
+    return 1
+
+
+def preprocess_cv2(image_bytes: bytes, image_size: Tuple[int, int] = (224, 224)) -> torch.Tensor:
+    """OpenCV alternative to `build_transform` working straight from upload bytes.
+
+    Large JPEGs are decoded at reduced resolution (IMREAD_REDUCED_COLOR_*),
+    resized with INTER_AREA, and the HWC uint8 buffer becomes a normalized
+    CHW float tensor via torch.from_numpy with a single fused multiply-add.
+    Matches the PIL transform within CV2_MEAN_ABS_TOLERANCE /
+    CV2_MAX_ABS_TOLERANCE (normalized units).
+    """
+    import cv2
+
+    buf = np.frombuffer(image_bytes, dtype=np.uint8)
+    flags = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2,
+             4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+    bgr = cv2.imdecode(buf, flags[_jpeg_reduction(image_bytes, image_size)])
+    if bgr is None:
+        raise ValueError("Could not decode image bytes")
+
+    height, width = image_size
+    if bgr.shape[0] != height or bgr.shape[1] != width:
+        shrinking = bgr.shape[0] > height and bgr.shape[1] > width
+        bgr = cv2.resize(bgr, (width, height),
+                         interpolation=cv2.INTER_AREA if shrinking else cv2.INTER_LINEAR)
+
+    # BGR -> RGB is one uint8 copy in numpy (torch.flip would copy too); HWC -> CHW is a view
+    chw = torch.from_numpy(np.ascontiguousarray(bgr[..., ::-1])).permute(2, 0, 1)
+    return torch.addcmul(_NORM_BIAS, chw.to(torch.float32), _NORM_SCALE).contiguous()
+
+
+def check_cv2_parity(image_bytes_list: Iterable[bytes],
+                     image_size: Tuple[int, int] = (224, 224)) -> dict:
+    """Compare preprocess_cv2 against the PIL transform; returns abs-diff stats."""
+    image_transform = build_transform(image_size)
+    mean_diffs, max_diffs = [], []
+    for image_bytes in image_bytes_list:
+        reference = image_transform(Image.open(BytesIO(image_bytes)).convert("RGB"))
+        diff = (preprocess_cv2(image_bytes, image_size) - reference).abs()
+        mean_diffs.append(diff.mean().item())
+        max_diffs.append(diff.max().item())
+    mean_abs = float(np.mean(mean_diffs)) if mean_diffs else 0.0
+    max_abs = float(np.max(max_diffs)) if max_diffs else 0.0
+    return {
+        "images": len(mean_diffs),
+        "mean_abs_diff": mean_abs,
+        "max_abs_diff": max_abs,
+        "within_tolerance": mean_abs <= CV2_MEAN_ABS_TOLERANCE and max_abs <= CV2_MAX_ABS_TOLERANCE,
+    }
+
+
+def _chunks(items: Iterable, size: int) -> Iterator[list]:
+    it = iter(items)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def pred_batch(model: torch.nn.Module, images: Iterable, class_names: List[str],
+               batch_size: int = 32, image_size: Tuple[int, int] = (224, 224),
+               device=None) -> np.ndarray:
+    """Score many PIL images with one forward pass per chunk of `batch_size`.
+
+    `images` may be a list or any iterator (only one chunk is held in memory at
+    a time). Items are PIL images, or CHW tensors that are already preprocessed
+    (e.g. from `preprocess_cv2`). Returns a float32 array of shape (n_images, len(class_names)) with
+    the softmax probabilities, columns in the same order as `class_names`.
+    """
+    predictor = Predictor(model, class_names, device, image_size, buffer_sizes=())
+    return predictor.predict_proba(images, batch_size)
+
+
+TTA_SHIFTS = (-16, -8, 8, 16)
+TTA_GAINS = (0.9, 1.1)
+# original + shifts + gains
+TTA_NUM_VIEWS = 1 + len(TTA_SHIFTS) + len(TTA_GAINS)
+
+
+def tta_views(x: torch.Tensor, shifts: Tuple[int, ...] = TTA_SHIFTS,
+              gains: Tuple[float, ...] = TTA_GAINS) -> torch.Tensor:
+    """Spectrogram-safe augmented views of one normalized CHW tensor, as a (V, C, H, W) batch.
+
+    Views: the original, time-axis (width) shifts with edge padding and
+    intensity gains applied in pixel space. Every row keeps its frequency:
+    no vertical flips, shifts, crops or rescaling of the frequency axis.
+    """
+    import torch.nn.functional as F
+
+    width = x.shape[-1]
+    views = [x]
+
+    # time shifts: pad with the edge column and crop back to the original width
+    for shift in shifts:
+        pad = (abs(shift), 0) if shift > 0 else (0, abs(shift))
+        padded = F.pad(x.unsqueeze(0), pad + (0, 0), mode="replicate")[0]
+        start = 0 if shift > 0 else abs(shift)
+        views.append(padded[:, :, start:start + width])
+
+    # intensity gain on the un-normalized image: a * pixel, re-normalized
+    mean = torch.tensor(IMAGENET_MEAN, dtype=x.dtype).view(3, 1, 1)
+    std = torch.tensor(IMAGENET_STD, dtype=x.dtype).view(3, 1, 1)
+    for gain in gains:
+        pixels = (x * std + mean) * gain
+        views.append((pixels.clamp(0, 1) - mean) / std)
+
+    return torch.stack(views)
+
+
+def pred_class_tta(model: torch.nn.Module, image, class_names: List[str], device=None,
+                   image_size: Tuple[int, int] = (224, 224)):
+    """Test-time augmentation: all views of `image` in one forward pass, probabilities averaged.
+
+    `image` is a PIL image or a preprocessed CHW tensor. Returns the same
+    (predicted_class, confidence, all_probs) triple as Predictor.predict, from
+    TTA_NUM_VIEWS views.
+    """
+    return Predictor(model, class_names, device, image_size, buffer_sizes=()).predict_tta(image)
+
+
+class Predictor:
+    """A loaded model ready to score, with all per-call setup done once.
+
+    Owns the model, device, input size and class names. The model is moved to
+    `device` and put in eval mode here, not on every call. Inputs are written
+    straight into preallocated (N, 3, H, W) buffers: PIL images are resized
+    and normalized in place (same math as `build_transform`), preprocessed CHW
+    tensors are copied in. Buffers are pooled per power-of-two batch size, so
+    steady-state calls allocate nothing but the output, and concurrent callers
+    (Streamlit sessions, server threads) each get their own buffer.
+    """
+
+    def __init__(self, model: torch.nn.Module, class_names: List[str], device=None,
+                 image_size: Tuple[int, int] = (224, 224), buffer_sizes: Tuple[int, ...] = (1, 8, 32)):
+        import threading
+
+        if device is None:
+            device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.model = model
+        self.class_names = list(class_names)
+        self.device = torch.device(device)
+        self.image_size = image_size
+        model.to(self.device)
+        model.eval()
+
+        # channels-last models (precision.CpuPrecisionModel) get NHWC buffers, so no per-call conversion
+        self._memory_format = (torch.channels_last if getattr(model, "channels_last", False)
+                               else torch.contiguous_format)
+        self._pin = self.device.type == "cuda"
+        self._pool_lock = threading.Lock()
+        self._free: dict = {}
+        for size in buffer_sizes:
+            self._release(self._acquire(size))
+
+    @staticmethod
+    def _bucket(n: int) -> int:
+        return 1 << max(0, n - 1).bit_length()
+
+    def _acquire(self, n: int):
+        """(host buffer, device buffer) with room for at least n images."""
+        size = self._bucket(n)
+        with self._pool_lock:
+            free = self._free.setdefault(size, [])
+            if free:
+                return free.pop()
+        shape = (size, 3, *self.image_size)
+        host = torch.empty(shape, pin_memory=self._pin, memory_format=self._memory_format)
+        if self.device.type == "cpu":
+            return host, host
+        return host, torch.empty_like(host, device=self.device)
+
+    def _release(self, buffers):
+        with self._pool_lock:
+            self._free.setdefault(buffers[0].shape[0], []).append(buffers)
+
+    def _fill(self, row: torch.Tensor, image):
+        """Write one PIL image or preprocessed CHW tensor into a buffer row."""
+        if isinstance(image, torch.Tensor):
+            if image.shape != row.shape:
+                raise ValueError(f"Expected a preprocessed {tuple(row.shape)} tensor, got {tuple(image.shape)}")
+            row.copy_(image)
+            return
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        height, width = self.image_size
+        if image.size != (width, height):
+            image = image.resize((width, height), Image.BILINEAR)
+        # np.array, not asarray: PIL's array view is read-only, which torch.from_numpy warns about
+        row.copy_(torch.from_numpy(np.array(image)).permute(2, 0, 1))
+        row.mul_(_NORM_SCALE).add_(_NORM_BIAS)
+
+    def _run(self, chunk: list, stage: str = "") -> np.ndarray:
+        """Softmax probabilities for one chunk of inputs, shape (len(chunk), n_classes)."""
+        buffers = self._acquire(len(chunk))
+        try:
+            host, dev = buffers
+            with timed(f"{stage}preprocess"):
+                for row, image in zip(host, chunk):
+                    self._fill(row, image)
+                if dev is not host:
+                    dev[:len(chunk)].copy_(host[:len(chunk)], non_blocking=True)
+            with torch.inference_mode():
+                with timed(f"{stage}forward"):
+                    logits = self.model(dev[:len(chunk)])
+                with timed(f"{stage}softmax"):
+                    probs = torch.softmax(logits, dim=1).float().cpu().numpy()
+        finally:
+            self._release(buffers)
+        if probs.shape[1] != len(self.class_names):
+            raise ValueError(f"Model returned {probs.shape[1]} classes, expected {len(self.class_names)}")
+        return probs
+
+    def predict(self, image):
+        """(predicted_class, confidence, all_probs) for one PIL image or CHW tensor."""
+        all_probs = self._run([image])[0]
+        predicted_idx = int(all_probs.argmax())
+        return self.class_names[predicted_idx], float(all_probs[predicted_idx]), all_probs
+
+    def predict_proba(self, images: Iterable, batch_size: int = 32) -> np.ndarray:
+        """Probabilities for any iterable of images, one forward pass per `batch_size` chunk."""
+        if batch_size < 1:
+            raise ValueError("batch_size must be >= 1")
+        rows = [self._run(chunk, stage="batch_") for chunk in _chunks(images, batch_size)]
+        if not rows:
+            return np.empty((0, len(self.class_names)), dtype=np.float32)
+        return np.concatenate(rows, axis=0)
+
+    def predict_tta(self, image):
+        """Like `predict`, averaged over the TTA_NUM_VIEWS views of `tta_views` in one pass."""
+        x = image if isinstance(image, torch.Tensor) else build_transform(self.image_size)(image)
+        all_probs = self._run(list(tta_views(x.float()))).mean(axis=0)
+        predicted_idx = int(all_probs.argmax())
+        return self.class_names[predicted_idx], float(all_probs[predicted_idx]), all_probs
@@ -0,0 +1,128 @@
+## Content-addressed cache for prediction results
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import numpy as np
+
+# (predicted_class, confidence, all_probs) - same contract as Predictor.predict
+Prediction = Tuple[str, float, np.ndarray]
+
+# rough per-entry overhead of the key, tuple and ndarray header
+_ENTRY_OVERHEAD = 256
+
+
+def model_identity(model_path: str) -> str:
+    """Cheap identity for a model file: name, size and modification time."""
+    try:
+        st = os.stat(model_path)
+    except OSError:
+        return os.path.basename(model_path)
+    return f"{os.path.basename(model_path)}:{st.st_size}:{st.st_mtime_ns}"
+
+
+def make_key(image_bytes: bytes, model_id: str) -> str:
+    """Hash of the raw upload bytes plus the model identity."""
+    h = hashlib.sha256()
+    h.update(model_id.encode("utf-8"))
+    h.update(b"\0")
+    h.update(image_bytes)
+    return h.hexdigest()
+
+
+class PredictionCache:
+    """Two-tier result cache: in-process LRU bounded by bytes, optional SQLite store.
+
+    Both tiers store only the prediction, never the image, so a hit skips
+    decoding and inference entirely. Safe to share between Streamlit sessions.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, db_path: Optional[str] = None):
+        self.max_bytes = max_bytes
+        self.db_path = db_path
+        self._lru: "OrderedDict[str, Prediction]" = OrderedDict()
+        self._lru_bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS predictions ("
+                " key TEXT PRIMARY KEY, predicted_class TEXT NOT NULL,"
+                " confidence REAL NOT NULL, probs BLOB NOT NULL)"
+            )
+            self._db.commit()
+
+    @staticmethod
+    def _entry_size(key: str, value: Prediction) -> int:
+        return len(key) + len(value[0]) + value[2].nbytes + _ENTRY_OVERHEAD
+
+    def _remember(self, key: str, value: Prediction):
+        # caller holds the lock
+        if key in self._lru:
+            self._lru.move_to_end(key)
+            return
+        self._lru[key] = value
+        self._lru_bytes += self._entry_size(key, value)
+        while self._lru_bytes > self.max_bytes and self._lru:
+            old_key, old_value = self._lru.popitem(last=False)
+            self._lru_bytes -= self._entry_size(old_key, old_value)
+            self._stats["evictions"] += 1
+
+    def get(self, key: str) -> Optional[Prediction]:
+        with self._lock:
+            value = self._lru.get(key)
+            if value is not None:
+                self._lru.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                return value
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT predicted_class, confidence, probs FROM predictions WHERE key = ?",
+                    (key,),
+                ).fetchone()
+                if row is not None:
+                    value = (row[0], row[1], np.frombuffer(row[2], dtype=np.float32).copy())
+                    self._remember(key, value)
+                    self._stats["disk_hits"] += 1
+                    return value
+
+            self._stats["misses"] += 1
+            return None
+
+    def put(self, key: str, predicted_class: str, confidence: float, all_probs):
+        probs = np.asarray(all_probs, dtype=np.float32)
+        value = (predicted_class, float(confidence), probs)
+        with self._lock:
+            self._remember(key, value)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?)",
+                    (key, predicted_class, float(confidence), probs.tobytes()),
+                )
+                self._db.commit()
+
+    def stats(self) -> dict:
+        """Hit/miss counters plus current memory-tier size, for sizing the cache."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._lru)
+            stats["memory_bytes"] = self._lru_bytes
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._lru.clear()
+            self._lru_bytes = 0
+            if self._db is not None:
+                self._db.execute("DELETE FROM predictions")
+                self._db.commit()
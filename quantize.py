@@ -0,0 +1,196 @@
+## INT8 quantization pipeline for the EfficientNet-B3 checkpoint
+import argparse
+import io
+import json
+import os
+import random
+import time
+from typing import List, Tuple
+
+import numpy as np
+import torch
+
+from prediction import build_transform, load_checkpoint, pred_batch
+
+INT8_PATH = "efficientnet_b3_fold1_int8.torchscript"
+
+
+def _quant_engine() -> str:
+    engines = torch.backends.quantized.supported_engines
+    for engine in ("x86", "fbgemm", "qnnpack"):
+        if engine in engines:
+            return engine
+    raise RuntimeError(f"No int8 CPU engine available (supported: {engines})")
+
+
+def quantize_model(model: torch.nn.Module, calibration_images: List,
+                   image_size: Tuple[int, int] = (224, 224), batch_size: int = 16) -> torch.nn.Module:
+    """Static PTQ for the conv stack, dynamic int8 for the classifier.
+
+    The conv stack is traced with FX, observed on `calibration_images` and
+    converted; the final Linear is then swapped for a dynamically quantized
+    one (weights int8, activations quantized per call).
+    """
+    from torch.ao.quantization import QConfigMapping, get_default_qconfig, quantize_dynamic
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+    engine = _quant_engine()
+    torch.backends.quantized.engine = engine
+
+    model = model.cpu().eval()
+    example_inputs = (torch.randn(1, 3, *image_size),)
+
+    # 1. Static qconfig everywhere except the classifier
+    qconfig_mapping = (QConfigMapping()
+                       .set_global(get_default_qconfig(engine))
+                       .set_module_name("classifier", None))
+    prepared = prepare_fx(model, qconfig_mapping, example_inputs)
+
+    # 2. Calibrate observers on sample spectrograms
+    image_transform = build_transform(image_size)
+    with torch.inference_mode():
+        for start in range(0, len(calibration_images), batch_size):
+            chunk = calibration_images[start:start + batch_size]
+            prepared(torch.stack([image_transform(img) for img in chunk]))
+
+    # 3. Convert conv stack, then dynamic-quantize the Linear head
+    quantized = convert_fx(prepared)
+    return quantize_dynamic(quantized, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def _save_torchscript(model: torch.nn.Module, f, image_size: Tuple[int, int] = (224, 224)):
+    with torch.inference_mode():
+        scripted = torch.jit.trace(model, torch.randn(1, 3, *image_size))
+    torch.jit.save(torch.jit.freeze(scripted.eval()), f)
+
+
+def save_int8(quantized: torch.nn.Module, path: str = INT8_PATH,
+              image_size: Tuple[int, int] = (224, 224)) -> str:
+    """Save as TorchScript so loading needs neither timm nor the FX graph."""
+    _save_torchscript(quantized, path, image_size)
+    return path
+
+
+def load_int8(path: str = INT8_PATH) -> torch.nn.Module:
+    """Load the int8 TorchScript model; a drop-in for the fp32 model on CPU."""
+    torch.backends.quantized.engine = _quant_engine()
+    model = torch.jit.load(path, map_location="cpu")
+    model.eval()
+    return model
+
+
+def _latency_ms(model: torch.nn.Module, x: torch.Tensor, runs: int, warmup: int = 5) -> np.ndarray:
+    timings = []
+    with torch.inference_mode():
+        for i in range(warmup + runs):
+            start = time.perf_counter()
+            model(x)
+            if i >= warmup:
+                timings.append((time.perf_counter() - start) * 1000)
+    return np.asarray(timings)
+
+
+def _torchscript_bytes(model: torch.nn.Module) -> int:
+    """Size of `model` serialized exactly like save_int8 writes the int8 model."""
+    buf = io.BytesIO()
+    _save_torchscript(model, buf)
+    return buf.tell()
+
+
+def split_holdout(images: List, eval_fraction: float = 0.25, seed: int = 0) -> Tuple[List, List]:
+    """Shuffle and split into (calibration, held-out eval) so the report never scores calibration images."""
+    if len(images) < 2:
+        raise ValueError("Need at least two images to hold some out for evaluation")
+    order = list(range(len(images)))
+    random.Random(seed).shuffle(order)
+    n_eval = min(len(images) - 1, max(1, round(len(images) * eval_fraction)))
+    return [images[i] for i in order[n_eval:]], [images[i] for i in order[:n_eval]]
+
+
+def compare_report(fp32_model: torch.nn.Module, int8_model: torch.nn.Module, images: List,
+                   class_names: List[str], int8_path: str, runs: int = 500) -> dict:
+    """Per-class agreement with fp32, p50/p99 batch-1 latency and TorchScript size.
+
+    `images` should be held out from calibration. With the default 500 timed
+    runs the p99 rests on five tail samples rather than on the single worst one.
+    """
+    cpu = torch.device("cpu")
+    fp32_probs = pred_batch(fp32_model, images, class_names, device=cpu)
+    int8_probs = pred_batch(int8_model, images, class_names, device=cpu)
+    fp32_pred = fp32_probs.argmax(1)
+    int8_pred = int8_probs.argmax(1)
+
+    per_class = {}
+    for idx, name in enumerate(class_names):
+        mask = fp32_pred == idx
+        per_class[name] = {
+            "fp32_count": int(mask.sum()),
+            "agreement": float((int8_pred[mask] == idx).mean()) if mask.any() else None,
+        }
+
+    x = build_transform()(images[0]).unsqueeze(0)
+    fp32_ms = _latency_ms(fp32_model, x, runs)
+    int8_ms = _latency_ms(int8_model, x, runs)
+
+    return {
+        "images": len(images),
+        "overall_agreement": float((fp32_pred == int8_pred).mean()),
+        "max_prob_abs_diff": float(np.abs(fp32_probs - int8_probs).max()),
+        "per_class": per_class,
+        "latency_runs": runs,
+        "latency_ms": {
+            "fp32": {"p50": float(np.percentile(fp32_ms, 50)), "p99": float(np.percentile(fp32_ms, 99))},
+            "int8": {"p50": float(np.percentile(int8_ms, 50)), "p99": float(np.percentile(int8_ms, 99))},
+        },
+        # both as frozen TorchScript, the format the app loads the int8 model from
+        "size_bytes": {"fp32": _torchscript_bytes(fp32_model), "int8": os.path.getsize(int8_path)},
+    }
+
+
+def main():
+    from artifacts import resolve_model_checkpoint
+    from fixtures import load_fixture_images
+
+    parser = argparse.ArgumentParser(description="Build the int8 model and report accuracy/latency vs fp32.")
+    parser.add_argument("--checkpoint", default="efficientnet_b3_checkpoint_fold1.pt")
+    parser.add_argument("--out", default=INT8_PATH)
+    parser.add_argument("--calibration", default=None, help="directory or glob of spectrograms (default: synthetic)")
+    parser.add_argument("--eval", default=None,
+                        help="images for the report (default: a held-out split of --calibration)")
+    parser.add_argument("--eval-fraction", type=float, default=0.25,
+                        help="share of --calibration held out for the report when --eval is not given")
+    parser.add_argument("--num-calibration", type=int, default=64)
+    parser.add_argument("--num-eval", type=int, default=32, help="synthetic eval images when no paths are given")
+    parser.add_argument("--runs", type=int, default=500, help="timed batch-1 runs per model for p50/p99")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--report", default="quantization_report.json")
+    args = parser.parse_args()
+    args.checkpoint = resolve_model_checkpoint(args.checkpoint)
+
+    class_names = ["Fear", "Happy", "Neutral", "Sad"]
+    if args.eval:
+        calibration = load_fixture_images(args.calibration, n=args.num_calibration, seed=args.seed)
+        eval_images = load_fixture_images(args.eval)
+    elif args.calibration:
+        calibration, eval_images = split_holdout(load_fixture_images(args.calibration),
+                                                 args.eval_fraction, args.seed)
+    else:
+        # synthetic: a different seed gives images the observers never saw
+        calibration = load_fixture_images(None, n=args.num_calibration, seed=args.seed)
+        eval_images = load_fixture_images(None, n=args.num_eval, seed=args.seed + 1)
+
+    fp32_model = load_checkpoint(args.checkpoint, "cpu")
+    # quantize a fresh copy, prepare_fx must not touch the reference model
+    quantized = quantize_model(load_checkpoint(args.checkpoint, "cpu"), calibration)
+    save_int8(quantized, args.out)
+
+    report = compare_report(fp32_model, load_int8(args.out), eval_images, class_names, args.out,
+                            runs=args.runs)
+    report["calibration_images"] = len(calibration)
+    with open(args.report, "w") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
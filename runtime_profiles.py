@@ -0,0 +1,81 @@
+## CPU threading / process-parallelism profiles for inference
+import os
+import sys
+from dataclasses import dataclass
+from typing import List, Optional
+
+PROFILE_NAMES = ("latency", "balanced", "throughput")
+
+
+@dataclass(frozen=True)
+class RuntimeProfile:
+    name: str
+    workers: int
+    intra_op_threads: int
+    inter_op_threads: int
+    pin_cpus: bool = False
+
+    @property
+    def total_threads(self) -> int:
+        return self.workers * self.intra_op_threads
+
+
+def available_cpus() -> List[int]:
+    """CPUs this process may run on (respects taskset / cgroup cpusets)."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def resolve_profile(name: str, cpus: Optional[int] = None, pin_cpus: bool = False) -> RuntimeProfile:
+    """Worker and thread counts for a named profile so workers x threads == cpus.
+
+    latency     one or two workers, each using many intra-op threads
+    balanced    four intra-op threads per worker
+    throughput  one worker per core (two threads each on big hosts)
+    """
+    cpus = cpus or len(available_cpus())
+    if name == "latency":
+        workers = 2 if cpus >= 16 else 1
+        threads = max(1, cpus // workers)
+    elif name == "balanced":
+        threads = min(4, cpus)
+        workers = max(1, cpus // threads)
+    elif name == "throughput":
+        threads = 2 if cpus >= 32 else 1
+        workers = max(1, cpus // threads)
+    else:
+        raise ValueError(f"Unknown runtime profile {name!r}; choose from {', '.join(PROFILE_NAMES)}")
+    return RuntimeProfile(name, workers, threads, inter_op_threads=1, pin_cpus=pin_cpus)
+
+
+def worker_cpus(profile: RuntimeProfile, slot: int) -> List[int]:
+    """Disjoint CPU slice for worker `slot` (wraps around if oversubscribed)."""
+    cpus = available_cpus()
+    start = (slot * profile.intra_op_threads) % len(cpus)
+    return [cpus[(start + i) % len(cpus)] for i in range(profile.intra_op_threads)]
+
+
+def apply_profile(profile: RuntimeProfile, slot: Optional[int] = None):
+    """Configure torch threads (and CPU affinity for worker `slot`) in this process.
+
+    Call before the first `import torch` (as server and benchmark workers do):
+    OMP_NUM_THREADS / MKL_NUM_THREADS are only read when the OpenMP and MKL
+    runtimes load, so they are exported only while that is still ahead. Later
+    callers (the Streamlit app) get the torch.set_num_threads settings alone.
+    """
+    if "torch" not in sys.modules:
+        # also sizes the OpenMP/MKL pools that cv2 or onnxruntime create later
+        os.environ["OMP_NUM_THREADS"] = str(profile.intra_op_threads)
+        os.environ["MKL_NUM_THREADS"] = str(profile.intra_op_threads)
+    import torch
+
+    if profile.pin_cpus and slot is not None and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, worker_cpus(profile, slot))
+
+    torch.set_num_threads(profile.intra_op_threads)
+    try:
+        torch.set_num_interop_threads(profile.inter_op_threads)
+    except RuntimeError:
+        # already initialised in this process; intra-op setting still applies
+        pass
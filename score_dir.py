@@ -0,0 +1,207 @@
+## Offline bulk scoring of spectrogram images
+#
+#   python score_dir.py spectrograms/ --out predictions.csv --workers 8
+#   python score_dir.py "archive/**/*.png" --out predictions.parquet
+import argparse
+import csv
+import glob
+import os
+import sys
+import time
+from typing import Iterator, List
+
+import torch
+from torch.utils.data import DataLoader, Dataset
+
+from fixtures import IMAGE_EXTENSIONS
+
+CLASS_NAMES = ["Fear", "Happy", "Neutral", "Sad"]
+
+
+def iter_image_paths(source: str) -> Iterator[str]:
+    """Lazily walk a directory tree or expand a glob; never builds the full file list."""
+    if os.path.isdir(source):
+        stack = [source]
+        while stack:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                        yield entry.path
+    else:
+        for path in glob.iglob(source, recursive=True):
+            if path.lower().endswith(IMAGE_EXTENSIONS) and os.path.isfile(path):
+                yield path
+
+
+class PathBatches:
+    """Batches of image paths, enumerated once by the main process.
+
+    Passed to the DataLoader as its batch_sampler: the loader pulls batches
+    lazily (prefetch_factor per worker ahead) and hands each one to a single
+    worker, so the tree is walked exactly once however many workers decode.
+    """
+
+    def __init__(self, source: str, batch_size: int):
+        self.source = source
+        self.batch_size = batch_size
+
+    def __iter__(self) -> Iterator[List[str]]:
+        batch = []
+        for path in iter_image_paths(self.source):
+            batch.append(path)
+            if len(batch) == self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+class ImageFiles(Dataset):
+    """Indexed by path: loads one image as (path, tensor), or (path, error message)."""
+
+    def __init__(self, preprocess: str = "pil"):
+        self.preprocess = preprocess
+
+    def _load(self, path: str):
+        from prediction import build_transform, preprocess_cv2
+
+        if self.preprocess == "cv2":
+            with open(path, "rb") as f:
+                return preprocess_cv2(f.read())
+        from PIL import Image
+        return build_transform((224, 224))(Image.open(path).convert("RGB"))
+
+    def __getitem__(self, path: str):
+        try:
+            return path, self._load(path)
+        except Exception as e:
+            # unreadable files are reported in the output, not fatal
+            return path, str(e)
+
+
+def collate(items):
+    paths, tensors, errors = [], [], []
+    for path, item in items:
+        if isinstance(item, torch.Tensor):
+            paths.append(path)
+            tensors.append(item)
+        else:
+            errors.append((path, item))
+    batch = torch.stack(tensors) if tensors else None
+    return paths, batch, errors
+
+
+class CsvSink:
+    def __init__(self, path: str):
+        self._file = open(path, "w", newline="", encoding="utf-8")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(["file", "predicted_class", "confidence", *CLASS_NAMES, "error"])
+
+    def write(self, rows: List[list]):
+        self._writer.writerows(rows)
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetSink:
+    """One row group per batch via pyarrow's ParquetWriter (optional dependency)."""
+
+    def __init__(self, path: str):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self._pa = pa
+        self._schema = pa.schema(
+            [("file", pa.string()), ("predicted_class", pa.string()), ("confidence", pa.float32())]
+            + [(name, pa.float32()) for name in CLASS_NAMES]
+            + [("error", pa.string())]
+        )
+        self._writer = pq.ParquetWriter(path, self._schema)
+
+    def write(self, rows: List[list]):
+        columns = list(zip(*rows))
+        self._writer.write_table(self._pa.table(
+            [self._pa.array(col, type=field.type) for col, field in zip(columns, self._schema)],
+            schema=self._schema,
+        ))
+
+    def close(self):
+        self._writer.close()
+
+
+def open_sink(path: str):
+    if path.endswith(".parquet"):
+        try:
+            return ParquetSink(path)
+        except ImportError:
+            raise SystemExit("Parquet output needs pyarrow (pip install pyarrow); use a .csv path instead")
+    return CsvSink(path)
+
+
+def main():
+    from prediction import load_model_headless
+
+    parser = argparse.ArgumentParser(description="Score a directory or glob of spectrogram images.")
+    parser.add_argument("source", help="directory (walked recursively) or glob pattern")
+    parser.add_argument("--out", default="predictions.csv", help=".csv or .parquet")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1),
+                        help="decode/preprocess worker processes")
+    parser.add_argument("--prefetch", type=int, default=4, help="batches prefetched per worker")
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads for inference")
+    parser.add_argument("--preprocess", choices=["pil", "cv2"], default="pil")
+    parser.add_argument("--checkpoint", default="efficientnet_b3_checkpoint_fold1.pt")
+    parser.add_argument("--fast-weights", default="efficientnet_b3_fold1.safetensors")
+    parser.add_argument("--report-every", type=float, default=10.0, help="seconds between progress lines")
+    args = parser.parse_args()
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    model = load_model_headless(args.checkpoint, args.fast_weights, device)
+
+    loader = DataLoader(
+        ImageFiles(args.preprocess),
+        batch_sampler=PathBatches(args.source, args.batch_size),
+        num_workers=args.workers,
+        prefetch_factor=args.prefetch if args.workers else None,
+        persistent_workers=False,
+        collate_fn=collate,
+    )
+
+    sink = open_sink(args.out)
+    scored = failed = 0
+    start = last_report = time.perf_counter()
+    try:
+        with torch.inference_mode():
+            for paths, batch, errors in loader:
+                rows = []
+                if batch is not None:
+                    probs = torch.softmax(model(batch.to(device)), dim=1).float().cpu().numpy()
+                    for path, row in zip(paths, probs):
+                        idx = int(row.argmax())
+                        rows.append([path, CLASS_NAMES[idx], float(row[idx]), *map(float, row), None])
+                rows.extend([path, None, None, *([None] * len(CLASS_NAMES)), error] for path, error in errors)
+                if rows:
+                    sink.write(rows)
+                scored += len(paths)
+                failed += len(errors)
+
+                now = time.perf_counter()
+                if now - last_report >= args.report_every:
+                    print(f"{scored} images, {scored / (now - start):.1f} img/s", file=sys.stderr)
+                    last_report = now
+    finally:
+        sink.close()
+
+    elapsed = time.perf_counter() - start
+    print(f"Scored {scored} images ({failed} unreadable) in {elapsed:.1f}s: "
+          f"{scored / elapsed if elapsed else 0.0:.1f} img/s -> {args.out}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
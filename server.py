@@ -0,0 +1,333 @@
+## Headless HTTP inference service
+#
+#   python server.py --port 8000 --workers 4
+#
+#   POST /predict        body: raw JPG/PNG bytes
+#   POST /predict/batch  body: {"images": ["<base64>", ...]}
+#   GET  /healthz        process is up
+#   GET  /readyz         model is loaded (503 until then)
+#   GET  /metrics        per-stage latency histograms of the worker that answers (Prometheus
+#                        text format, labelled worker/pid); with --metrics-port P each worker
+#                        also serves its own /metrics on P + worker slot for complete scrapes
+#   GET  /stats          micro-batching queue depth and batch-size histograms
+import argparse
+import base64
+import json
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+
+from runtime_profiles import PROFILE_NAMES, available_cpus, resolve_profile
+
+CLASS_NAMES = ["Fear", "Happy", "Neutral", "Sad"]
+MAX_BODY_BYTES = 64 * 1024 * 1024
+# supervisor: restart delay doubles per consecutive crash of a slot, up to this cap
+MAX_RESTART_DELAY_S = 60.0
+# a worker that stayed up this long resets its slot's crash count
+STABLE_WORKER_S = 60.0
+# unread bodies up to this size are drained on early replies so keep-alive connections stay usable
+MAX_DRAIN_BYTES = 1024 * 1024
+
+
+class InferenceState:
+    """Per-worker model, filled in after fork so each process owns its threads."""
+    model = None
+    predictor = None
+    device = None
+    worker = 0
+    preprocess = "pil"
+    batch_size = 32
+    microbatcher = None
+
+
+def predict_bytes(images_bytes):
+    """Decode + preprocess like pred_class and score all images in batched passes."""
+    import torch
+    from PIL import Image
+    from prediction import build_transform, preprocess_cv2
+
+    from metrics import timed
+
+    def decode(b):
+        with timed("decode"):
+            if InferenceState.preprocess == "cv2":
+                return preprocess_cv2(b)
+            return Image.open(BytesIO(b)).convert("RGB")
+
+    inputs = (decode(b) for b in images_bytes)
+
+    if InferenceState.microbatcher is not None and len(images_bytes) == 1:
+        # single requests from concurrent connections share one forward pass
+        (item,) = inputs
+        if not isinstance(item, torch.Tensor):
+            item = build_transform((224, 224))(item)
+        probs = [InferenceState.microbatcher.predict(item, timeout=60)]
+    else:
+        probs = InferenceState.predictor.predict_proba(inputs, batch_size=InferenceState.batch_size)
+    results = []
+    for row in probs:
+        idx = int(row.argmax())
+        results.append({
+            "predicted_class": CLASS_NAMES[idx],
+            "confidence": float(row[idx]),
+            "probabilities": {name: float(p) for name, p in zip(CLASS_NAMES, row)},
+        })
+    return results
+
+
+def worker_labels() -> dict:
+    """Prometheus labels that keep each pre-fork worker's registry in its own series."""
+    return {"worker": str(InferenceState.worker), "pid": str(os.getpid())}
+
+
+class InferenceHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps connections alive as long as every response has a Content-Length
+    protocol_version = "HTTP/1.1"
+    server_version = "EmotionInference/1.0"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send_json(self, status: int, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if self.close_connection:
+            self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _content_length(self) -> int:
+        try:
+            return int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            return -1
+
+    def _read_body(self) -> bytes:
+        length = self._content_length()
+        if length <= 0 or length > MAX_BODY_BYTES:
+            # the body (if any) stays unread; its bytes must not be parsed as the next request
+            self.close_connection = True
+            if length > MAX_BODY_BYTES:
+                raise ValueError(f"Request body larger than {MAX_BODY_BYTES} bytes")
+            raise ValueError("Empty request body" if length == 0 else "Invalid Content-Length")
+        return self.rfile.read(length)
+
+    def _discard_body(self):
+        """Consume the body of a request answered without reading it, or close the connection."""
+        length = self._content_length()
+        if 0 <= length <= MAX_DRAIN_BYTES and "Transfer-Encoding" not in self.headers:
+            self.rfile.read(length)
+        else:
+            self.close_connection = True
+
+    def do_GET(self):
+        if self.path == "/healthz":
+            self._send_json(200, {"status": "ok", "pid": os.getpid()})
+        elif self.path == "/metrics":
+            from metrics import METRICS
+            body = METRICS.prometheus_text(labels=worker_labels()).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        elif self.path == "/stats":
+            batcher = InferenceState.microbatcher
+            self._send_json(200, {"microbatch": batcher.stats() if batcher is not None else None})
+        elif self.path == "/readyz":
+            ready = InferenceState.model is not None
+            self._send_json(200 if ready else 503, {"ready": ready, "class_names": CLASS_NAMES})
+        else:
+            self._send_json(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path not in ("/predict", "/predict/batch"):
+            self._discard_body()
+            self._send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+        if InferenceState.model is None:
+            self._discard_body()
+            self._send_json(503, {"error": "Model not loaded"})
+            return
+        try:
+            body = self._read_body()
+            if self.path == "/predict":
+                images = [body]
+            else:
+                images = [base64.b64decode(item) for item in json.loads(body)["images"]]
+        except (ValueError, KeyError, TypeError) as e:
+            self._send_json(400, {"error": str(e)})
+            return
+
+        try:
+            start = time.perf_counter()
+            results = predict_bytes(images)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+        except Exception as e:
+            self._send_json(422, {"error": f"Error in prediction: {e}"})
+            return
+
+        if self.path == "/predict":
+            self._send_json(200, dict(results[0], latency_ms=elapsed_ms))
+        else:
+            self._send_json(200, {"results": results, "latency_ms": elapsed_ms})
+
+
+class InferenceServer(ThreadingHTTPServer):
+    daemon_threads = True
+    verbose = False
+
+
+def serve_worker(sock: socket.socket, args, slot: int = 0):
+    """Worker process: load the model, then serve on the shared listening socket."""
+    from runtime_profiles import RuntimeProfile, apply_profile
+
+    # before the first torch import, so the OpenMP/MKL thread variables take effect
+    apply_profile(RuntimeProfile(args.profile or "custom", args.workers, args.threads,
+                                 inter_op_threads=1, pin_cpus=args.pin_cpus), slot)
+    import torch
+
+    InferenceState.device = torch.device("cpu")
+    InferenceState.worker = slot
+    if args.metrics_port:
+        from metrics import start_exporter
+        start_exporter(args.metrics_port + slot, args.host, labels=worker_labels())
+    InferenceState.preprocess = args.preprocess
+    InferenceState.batch_size = args.batch_size
+
+    server = InferenceServer((args.host, args.port), InferenceHandler, bind_and_activate=False)
+    server.socket.close()
+    server.socket = sock
+    server.verbose = args.verbose
+
+    # /healthz answers while the model loads; /readyz flips once it is in memory
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    from prediction import Predictor, load_model_headless
+
+    model = load_model_headless(args.checkpoint, args.fast_weights)
+    InferenceState.predictor = Predictor(model, CLASS_NAMES, InferenceState.device,
+                                         buffer_sizes=(1, args.batch_size))
+    if args.microbatch_size > 1:
+        from microbatch import MicroBatcher
+        InferenceState.microbatcher = MicroBatcher(model, InferenceState.device,
+                                                   max_batch_size=args.microbatch_size,
+                                                   max_wait_ms=args.microbatch_wait_ms)
+    InferenceState.model = model
+    signal.sigwait({signal.SIGTERM, signal.SIGINT})
+    server.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP inference server for the emotion model.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--profile", choices=PROFILE_NAMES, default=None,
+                        help="sets --workers/--threads consistently for this host")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads per worker")
+    parser.add_argument("--pin-cpus", action="store_true", help="pin each worker to its own CPU slice")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--preprocess", choices=["pil", "cv2"], default="pil")
+    parser.add_argument("--checkpoint", default="efficientnet_b3_checkpoint_fold1.pt")
+    parser.add_argument("--fast-weights", default="efficientnet_b3_fold1.safetensors")
+    parser.add_argument("--microbatch-size", type=int, default=1,
+                        help="> 1 batches concurrent single-image requests (N)")
+    parser.add_argument("--microbatch-wait-ms", type=float, default=5.0,
+                        help="max time to wait for a micro-batch to fill (T)")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="also serve each worker's /metrics on this port + worker slot")
+    parser.add_argument("--max-restarts", type=int, default=5,
+                        help="consecutive crashes of one worker slot before the server exits non-zero")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+    profile = resolve_profile(args.profile or "balanced")
+    if args.workers is None:
+        args.workers = profile.workers
+    if args.threads is None:
+        args.threads = max(1, len(available_cpus()) // args.workers)
+
+    # Bind once in the parent; forked workers accept on the same socket
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(128)
+
+    children = {}
+    started = {}
+    crashes = {}
+
+    def spawn(slot: int):
+        pid = os.fork()
+        if pid == 0:
+            signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGTERM, signal.SIGINT})
+            code = 0
+            try:
+                serve_worker(sock, args, slot)
+            except Exception:
+                traceback.print_exc()
+                code = 1
+            finally:
+                os._exit(code)
+        children[pid] = slot
+        started[slot] = time.monotonic()
+
+    for slot in range(args.workers):
+        spawn(slot)
+    print(f"Serving on http://{args.host}:{args.port} with {args.workers} workers "
+          f"x {args.threads} threads", file=sys.stderr)
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    # Supervise: restart workers that die unexpectedly, backing off while a slot keeps crashing
+    # (e.g. the model cannot be fetched) and giving up after --max-restarts in a row
+    exit_code = 0
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        slot = children.pop(pid, None)
+        if stopping or slot is None:
+            continue
+        if time.monotonic() - started[slot] >= STABLE_WORKER_S:
+            crashes[slot] = 0
+        crashes[slot] = crashes.get(slot, 0) + 1
+        if crashes[slot] > args.max_restarts:
+            print(f"Worker {pid} exited ({status}); slot {slot} crashed {crashes[slot]} times in a row, "
+                  f"shutting down", file=sys.stderr)
+            exit_code = 1
+            stop(signal.SIGTERM, None)
+            continue
+        delay = min(MAX_RESTART_DELAY_S, 2.0 ** (crashes[slot] - 1))
+        print(f"Worker {pid} exited ({status}), restarting in {delay:.0f}s", file=sys.stderr)
+        time.sleep(delay)
+        if not stopping:
+            spawn(slot)
+    sock.close()
+    if exit_code:
+        sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
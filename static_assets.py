@@ -0,0 +1,63 @@
+## Banner variants and CSS helpers for Streamlit static file serving
+import os
+import re
+import shutil
+from typing import Dict, Tuple
+
+STATIC_DIR = "static"
+# Streamlit serves ./static at this URL when server.enableStaticServing is on
+STATIC_URL = "app/static"
+BANNER_WIDTHS = (640, 1280, 1920)
+
+
+def _is_fresh(target: str, source: str) -> bool:
+    return os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(source)
+
+
+def build_banner_variants(source: str, static_dir: str = STATIC_DIR,
+                          widths: Tuple[int, ...] = BANNER_WIDTHS) -> Dict[str, Dict[int, str]]:
+    """Write resized WebP (and AVIF, when Pillow supports it) copies of `source`.
+
+    Returns {format: {width: url}} plus a "png" entry for the original.
+    Variants already newer than the source are reused, so this is cheap
+    after the first run. Streamlit's static handler only serves a fixed set
+    of image types with a real content type (WebP yes, AVIF no), so the CSS
+    uses WebP; AVIF files are there for a fronting proxy or CDN.
+    """
+    from PIL import Image
+
+    os.makedirs(static_dir, exist_ok=True)
+    name = os.path.splitext(os.path.basename(source))[0]
+    formats = ["webp"]
+    if ".avif" in Image.registered_extensions():
+        formats.append("avif")
+
+    variants: Dict[str, Dict[int, str]] = {fmt: {} for fmt in formats}
+    png_target = os.path.join(static_dir, os.path.basename(source))
+    if not _is_fresh(png_target, source):
+        shutil.copyfile(source, png_target)
+    variants["png"] = {0: f"{STATIC_URL}/{os.path.basename(source)}"}
+
+    with Image.open(source) as img:
+        img = img.convert("RGB")
+        for width in widths:
+            width = min(width, img.width)
+            height = round(img.height * width / img.width)
+            resized = None
+            for fmt in formats:
+                filename = f"{name}-{width}.{fmt}"
+                target = os.path.join(static_dir, filename)
+                if not _is_fresh(target, source):
+                    if resized is None:
+                        resized = img.resize((width, height), Image.LANCZOS)
+                    resized.save(target, quality=80)
+                variants[fmt][width] = f"{STATIC_URL}/{filename}"
+    return variants
+
+
+def minify_css(css: str) -> str:
+    """Strip comments and collapse whitespace; enough for the hand-written app CSS."""
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.S)
+    css = re.sub(r"\s+", " ", css)
+    css = re.sub(r"\s*([{};,>])\s*", r"\1", css)
+    return css.replace(";}", "}").strip()
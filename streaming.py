@@ -0,0 +1,125 @@
+## Streaming sliding-window inference over continuous EEG
+import asyncio
+from typing import AsyncIterable, AsyncIterator, Iterable, Iterator, List, Tuple
+
+import numpy as np
+import torch
+
+from eeg import SpectrogramConfig, render_batch, stft_power, to_model_tensor
+
+# (window end time in seconds, class probabilities in class_names order)
+StreamResult = Tuple[float, np.ndarray]
+
+
+class StreamingEngine:
+    """Rolling emotion predictions over an EEG stream with bounded memory.
+
+    Samples are pushed in chunks of any size. Only the STFT frames that the
+    new samples complete are computed; frames go into a ring buffer that
+    holds exactly one analysis window. Every `step_seconds` a window is
+    snapshotted, and ready windows are scored `batch_size` at a time in one
+    forward pass. Memory is O(window + batch_size windows), whatever the
+    stream length.
+    """
+
+    def __init__(self, model, fs: float, n_channels: int, class_names: List[str],
+                 window_seconds: float = 10.0, step_seconds: float = 1.0, batch_size: int = 8,
+                 cfg: SpectrogramConfig = SpectrogramConfig(), device=None):
+        self.model = model
+        self.fs = fs
+        self.n_channels = n_channels
+        self.class_names = class_names
+        self.cfg = cfg
+        self.batch_size = batch_size
+        self.device = device if device is not None else torch.device("cpu")
+
+        window_samples = int(round(window_seconds * fs))
+        if window_samples < cfg.nperseg:
+            raise ValueError("window_seconds is shorter than one STFT frame")
+        self.frames_per_window = (window_samples - cfg.nperseg) // cfg.hop + 1
+        self.step_frames = max(1, int(round(step_seconds * fs / cfg.hop)))
+
+        n_freqs = cfg.nperseg // 2 + 1
+        self._ring = np.zeros((n_channels, n_freqs, self.frames_per_window), dtype=np.float32)
+        self._frames_seen = 0
+        # samples not yet consumed by a frame (always < nperseg after each push)
+        self._pending = np.zeros((n_channels, 0), dtype=np.float32)
+        self._ready: List[Tuple[float, np.ndarray]] = []
+
+    def _frame_end_time(self, frame_index: int) -> float:
+        return (frame_index * self.cfg.hop + self.cfg.nperseg) / self.fs
+
+    def _window(self) -> np.ndarray:
+        """Current window in time order, (channels, freqs, frames)."""
+        start = self._frames_seen % self.frames_per_window
+        return np.roll(self._ring, -start, axis=2)
+
+    def push(self, samples: np.ndarray) -> List[StreamResult]:
+        """Add (channels, n) samples; returns any predictions that became ready."""
+        samples = np.asarray(samples, dtype=np.float32)
+        if samples.ndim != 2 or samples.shape[0] != self.n_channels:
+            raise ValueError(f"Expected ({self.n_channels}, n) samples, got {samples.shape}")
+        buf = np.concatenate([self._pending, samples], axis=1)
+
+        nperseg, hop = self.cfg.nperseg, self.cfg.hop
+        n_new = 0 if buf.shape[1] < nperseg else (buf.shape[1] - nperseg) // hop + 1
+        results: List[StreamResult] = []
+        if n_new:
+            # STFT of the new frames only
+            used = (n_new - 1) * hop + nperseg
+            power = stft_power(buf[:, :used], nperseg, hop)  # (channels, freqs, n_new)
+            for i in range(n_new):
+                self._ring[:, :, self._frames_seen % self.frames_per_window] = power[:, :, i]
+                self._frames_seen += 1
+                if (self._frames_seen >= self.frames_per_window
+                        and (self._frames_seen - self.frames_per_window) % self.step_frames == 0):
+                    end_time = self._frame_end_time(self._frames_seen - 1)
+                    self._ready.append((end_time, self._window()))
+                    if len(self._ready) >= self.batch_size:
+                        results.extend(self._run_ready())
+            buf = buf[:, n_new * hop:]
+        self._pending = buf
+        return results
+
+    def _run_ready(self) -> List[StreamResult]:
+        if not self._ready:
+            return []
+        times, windows = zip(*self._ready)
+        self._ready = []
+        power = np.stack(windows, axis=1)  # (channels, windows, freqs, frames)
+        inputs = to_model_tensor(render_batch(power, self.fs, self.cfg), self.cfg.image_size)
+        with torch.inference_mode():
+            probs = torch.softmax(self.model(inputs.to(self.device)), dim=1).float().cpu().numpy()
+        return list(zip(times, probs))
+
+    def flush(self) -> List[StreamResult]:
+        """Score windows that are ready but did not fill a batch."""
+        return self._run_ready()
+
+    def run(self, chunks: Iterable[np.ndarray]) -> Iterator[StreamResult]:
+        """Generator over (time, probs) for an iterable of (channels, n) chunks."""
+        for chunk in chunks:
+            yield from self.push(chunk)
+        yield from self.flush()
+
+    async def arun(self, chunks: AsyncIterable[np.ndarray]) -> AsyncIterator[StreamResult]:
+        """Async version of run(); inference runs in a worker thread so the event loop stays free."""
+        async for chunk in chunks:
+            for result in await asyncio.to_thread(self.push, chunk):
+                yield result
+        for result in await asyncio.to_thread(self.flush):
+            yield result
+
+
+def replay(x: np.ndarray, fs: float, chunk_seconds: float = 0.25) -> Iterator[np.ndarray]:
+    """Split a recorded (channels, samples) array into stream-sized chunks."""
+    step = max(1, int(round(chunk_seconds * fs)))
+    for start in range(0, x.shape[1], step):
+        yield x[:, start:start + step]
+
+
+def stream_predictions(model, x: np.ndarray, fs: float, class_names: List[str],
+                       device=None, **kwargs) -> Iterator[StreamResult]:
+    """Convenience: replay a recording through a StreamingEngine."""
+    engine = StreamingEngine(model, fs, x.shape[0], class_names, device=device, **kwargs)
+    return engine.run(replay(x, fs))
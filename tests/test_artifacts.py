@@ -0,0 +1,83 @@
+## Resolving the checkpoint from an EMOTION_ARTIFACT_MIRRORS HTTP mirror
+import hashlib
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import artifacts  # noqa: E402
+
+PAYLOAD = os.urandom(200_000)
+SHA256 = hashlib.sha256(PAYLOAD).hexdigest()
+
+
+class _RangeHandler(BaseHTTPRequestHandler):
+    """Serves PAYLOAD at /f.pt and honours "Range: bytes=N-" (http.server's own handler does not)."""
+    ranges = []
+
+    def do_GET(self):
+        if self.path != "/f.pt":
+            self.send_error(404)
+            return
+        requested = self.headers.get("Range")
+        self.ranges.append(requested)
+        start = int(requested[len("bytes="):].rstrip("-")) if requested else 0
+        body = PAYLOAD[start:]
+        self.send_response(206 if requested else 200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def mirror_url():
+    _RangeHandler.ranges = []
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), _RangeHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}/f.pt"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def pointer(tmp_path):
+    path = tmp_path / "efficientnet_b3_checkpoint_fold9.pt"
+    path.write_text(f"version https://git-lfs.github.com/spec/v1\noid sha256:{SHA256}\nsize {len(PAYLOAD)}\n")
+    return str(path)
+
+
+def test_mirror_list_keeps_urls_whole(mirror_url):
+    sources = artifacts.mirror_sources(f"{mirror_url}, /mnt/models/f.pt  /srv/f.pt")
+    assert [type(s).__name__ for s in sources] == ["HttpSource", "LocalFileSource", "LocalFileSource"]
+    assert sources[0].url == mirror_url
+
+
+def test_checkpoint_resolves_from_http_mirror(tmp_path, monkeypatch, mirror_url, pointer):
+    monkeypatch.setenv("EMOTION_ARTIFACT_MIRRORS", mirror_url)
+    cache_dir = str(tmp_path / "cache")
+    path = artifacts.resolve_model_checkpoint(pointer, cache_dir=cache_dir)
+    with open(path, "rb") as f:
+        assert f.read() == PAYLOAD
+    assert _RangeHandler.ranges == [None]
+
+
+def test_partial_download_resumes_from_mirror(tmp_path, monkeypatch, mirror_url, pointer):
+    monkeypatch.setenv("EMOTION_ARTIFACT_MIRRORS", mirror_url)
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+    half = len(PAYLOAD) // 2
+    part = cache_dir / f"{SHA256[:16]}-{os.path.basename(pointer)}.part"
+    part.write_bytes(PAYLOAD[:half])
+
+    path = artifacts.resolve_model_checkpoint(pointer, cache_dir=str(cache_dir))
+    with open(path, "rb") as f:
+        assert f.read() == PAYLOAD
+    assert _RangeHandler.ranges == [f"bytes={half}-"]
+    assert not part.exists()
@@ -0,0 +1,16 @@
+## Startup import guard: heavy modules stay lazy in app.py and `import prediction`
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# the guard imports prediction (and so torch) in a child interpreter with -X importtime
+pytest.importorskip("torch")
+
+import benchmark  # noqa: E402
+
+
+def test_startup_imports_stay_lazy():
+    assert benchmark.check_imports() == []
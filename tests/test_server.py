@@ -0,0 +1,65 @@
+## Keep-alive behaviour of the inference server's early error replies
+import http.client
+import json
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import server  # noqa: E402
+
+
+@pytest.fixture
+def http_server():
+    # model stays None, so /predict answers 503 without touching torch
+    httpd = server.InferenceServer(("127.0.0.1", 0), server.InferenceHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _connect(httpd):
+    return http.client.HTTPConnection("127.0.0.1", httpd.server_address[1], timeout=10)
+
+
+def _healthz_on_same_socket(conn):
+    sock = conn.sock
+    conn.request("GET", "/healthz")
+    response = conn.getresponse()
+    assert response.status == 200
+    assert json.loads(response.read())["status"] == "ok"
+    assert conn.sock is sock
+
+
+@pytest.mark.parametrize("path, status", [("/unknown", 404), ("/predict", 503)])
+def test_early_reply_drains_body_for_next_request(http_server, path, status):
+    conn = _connect(http_server)
+    conn.request("POST", path, body=b"x" * 4096)
+    response = conn.getresponse()
+    assert response.status == status
+    response.read()
+    assert response.getheader("Connection") is None
+    _healthz_on_same_socket(conn)
+    conn.close()
+
+
+def test_oversized_body_closes_connection(http_server, monkeypatch):
+    monkeypatch.setattr(server, "MAX_BODY_BYTES", 16)
+    monkeypatch.setattr(server.InferenceState, "model", object())
+    conn = _connect(http_server)
+    conn.request("POST", "/predict", body=b"x" * 4096)
+    response = conn.getresponse()
+    assert response.status == 400
+    response.read()
+    assert response.getheader("Connection") == "close"
+    conn.close()
+
+    # a fresh connection is served normally
+    conn = _connect(http_server)
+    conn.connect()
+    _healthz_on_same_socket(conn)
+    conn.close()